@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Incremental build of the whole pipeline:
+MP4 -> output_sections/*.wav, *.jpg -> output_sections_mp3/*.mp3 (trimmed)
+
+Every artifact is recorded in a fingerprint store together with a hash of
+what it was built from: the content of its inputs, the parameters and the
+source of the code that builds it. A re-run rebuilds only the artifacts
+whose fingerprint changed or whose file is gone, and reports the rest as
+skipped. Editing one section's WAV re-encodes just that section's MP3.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import convert_to_mp3
+import mp3_frames
+import pcm_buffer
+import process_video
+import scene_detect
+import silence_analysis
+import summary_io
+import trim_silence_inplace
+from disk_cache import cache_key, fast_file_hash, full_file_hash
+
+STORE_NAME = "build_fingerprints.json"
+
+def code_version(*modules):
+    """Hash of the source of the modules that build an artifact"""
+    h = hashlib.blake2b(digest_size=16)
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+class FingerprintStore:
+    """Fingerprint, stat, content hash and summary record of every artifact"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, artifact, fingerprint):
+        entry = self.entries.get(str(artifact))
+        return entry is not None and entry['fingerprint'] == fingerprint and \
+            os.path.exists(artifact)
+
+    def content_hash(self, artifact):
+        """
+        Content hash of an artifact, read from the store while its size and
+        mtime are unchanged, so only edited files are hashed again.
+        """
+        entry = self.entries.get(str(artifact))
+        st = os.stat(artifact)
+        if entry is not None and (entry['size'], entry['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+            return entry['hash']
+        digest = full_file_hash(artifact)
+        if entry is not None:
+            entry['size'], entry['mtime_ns'], entry['hash'] = st.st_size, st.st_mtime_ns, digest
+        return digest
+
+    def record(self, artifact, fingerprint, record=None):
+        st = os.stat(artifact)
+        self.entries[str(artifact)] = {
+            'fingerprint': fingerprint,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'hash': full_file_hash(artifact),
+            'record': record
+        }
+
+    def get_record(self, artifact):
+        return self.entries[str(artifact)]['record']
+
+    def save(self):
+        summary_io.write_json_atomic(self.path, self.entries)
+
+def build_sections(video_path, segments, threshold, sections_dir, store, report):
+    """
+    Extract the WAV and JPG of every section whose interval (or the video,
+    or the extraction code) changed. Stale sections of a kind are extracted
+    together in one pass. Returns the section records.
+    """
+    video_hash = fast_file_hash(video_path)
+    version = code_version(process_video)
+    records = []
+    stale_audio, stale_images = [], []
+    for i, (start, end) in enumerate(segments):
+        section_num = i + 1
+        wav_path = sections_dir / f"section_{section_num:03d}.wav"
+        img_path = sections_dir / f"section_{section_num:03d}.jpg"
+        wav_fp = cache_key('wav', video_hash, start, end, version)
+        img_fp = cache_key('jpg', video_hash, start + 0.3, version)
+        if store.is_current(wav_path, wav_fp):
+            report['wav'][1] += 1
+        else:
+            stale_audio.append(((start, end), wav_path, wav_fp))
+        if store.is_current(img_path, img_fp):
+            report['jpg'][1] += 1
+        else:
+            stale_images.append((start + 0.3, img_path, img_fp))
+        records.append({
+            'section': section_num,
+            'start_time': start,
+            'end_time': end,
+            'duration': end - start,
+            'image': img_path.name,
+            'audio': wav_path.name,
+            'scene_threshold': threshold
+        })
+
+    # The extractors raise if ffmpeg fails, so only produced files are recorded
+    if stale_images:
+        print(f"\nExtracting {len(stale_images)} images...")
+        process_video.extract_still_images(video_path, [t for t, _, _ in stale_images],
+                                           [p for _, p, _ in stale_images])
+        for _, path, fp in stale_images:
+            store.record(path, fp)
+    if stale_audio:
+        print(f"\nExtracting {len(stale_audio)} audio sections...")
+        process_video.extract_audio_segments(video_path, [s for s, _, _ in stale_audio],
+                                             [p for _, p, _ in stale_audio])
+        for _, path, fp in stale_audio:
+            store.record(path, fp)
+    report['jpg'][0] += len(stale_images)
+    report['wav'][0] += len(stale_audio)
+    return records
+
+def build_mp3(section, sections_dir, mp3_dir, args, trim_params):
+    """
+    Convert one section to MP3 and trim it. Returns (record, log, done):
+    record is None if encoding failed, done is False if either step failed.
+    """
+    new_section, log = convert_to_mp3.process_section(section, sections_dir, mp3_dir, args, {})
+    if new_section is None:
+        return None, log, False
+    done = True
+    if not args.no_trim:
+        new_section, trim_log, done = trim_silence_inplace.trim_section(new_section, mp3_dir,
+                                                                        args, trim_params)
+        log += trim_log
+    return new_section, log, done
+
+def build_mp3s(sections, sections_dir, mp3_dir, args, store, report):
+    """
+    Encode and trim the MP3 of every section whose WAV content, parameters
+    or code changed. Trimming works in place, so both steps form one
+    artifact: new trim settings re-encode from the WAV rather than trimming
+    an already trimmed file again. Returns the MP3 section records.
+    """
+    trim_params = {
+        'noise_db': args.noise_db,
+        'min_duration': 0.2,
+        'silence_backend': args.silence_backend,
+        'lossless': args.lossless
+    }
+    convert_params = {'noise_db': args.noise_db, 'silence_backend': args.silence_backend}
+    version = code_version(convert_to_mp3, trim_silence_inplace, silence_analysis,
+                           mp3_frames, pcm_buffer)
+
+    results = [None] * len(sections)
+    stale = []
+    for i, section in enumerate(sections):
+        # The image is only copied, so its fingerprint is the source content
+        img_src = sections_dir / section['image']
+        img_dst = mp3_dir / section['image']
+        img_fp = cache_key('copy', store.content_hash(img_src))
+        if store.is_current(img_dst, img_fp):
+            report['image copy'][1] += 1
+        else:
+            shutil.copy(str(img_src), str(img_dst))
+            store.record(img_dst, img_fp)
+            report['image copy'][0] += 1
+
+        mp3_path = mp3_dir / f"section_{section['section']:03d}.mp3"
+        mp3_fp = cache_key('mp3', store.content_hash(sections_dir / section['audio']),
+                           convert_params, None if args.no_trim else trim_params,
+                           section['start_time'], section['end_time'],
+                           section['scene_threshold'], version)
+        if store.is_current(mp3_path, mp3_fp):
+            results[i] = store.get_record(mp3_path)
+            report['mp3'][1] += 1
+        else:
+            stale.append((i, mp3_path, mp3_fp))
+
+    # Longest sections first, so the last ones to finish are short
+    stale.sort(key=lambda item: -sections[item[0]]['duration'])
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(build_mp3, sections[i], sections_dir, mp3_dir, args, trim_params):
+                (i, mp3_path, mp3_fp)
+            for i, mp3_path, mp3_fp in stale
+        }
+        for future in as_completed(futures):
+            i, mp3_path, mp3_fp = futures[future]
+            new_section, log, done = future.result()
+            print('\n'.join(log))
+            # A failed section keeps no fingerprint, so the next run retries it
+            if done:
+                store.record(mp3_path, mp3_fp, new_section)
+            else:
+                failed += 1
+            results[i] = new_section
+    report['mp3'][0] += len(stale) - failed
+    if failed:
+        print(f"\n{failed} MP3s failed, they are rebuilt on the next run")
+    return [record for record in results if record is not None]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='?', default="吴语上丽片-松阳话 [BV1icCyYAEr5].mp4")
+    parser.add_argument('--sections-dir', default="output_sections")
+    parser.add_argument('--mp3-dir', default="output_sections_mp3")
+    parser.add_argument('--threshold', default='0.02',
+                        help="scene change threshold (0.0-1.0), or 'auto'")
+    parser.add_argument('--detector', choices=sorted(process_video.DETECTORS), default='numpy')
+    parser.add_argument('--silence-backend', choices=['numpy', 'ffmpeg'], default='numpy')
+    parser.add_argument('--noise-db', default='-40',
+                        help="silence threshold in dB, or 'auto'")
+    parser.add_argument('--lossless', action='store_true',
+                        help="trim on MP3 frame boundaries instead of re-encoding")
+    parser.add_argument('--no-trim', action='store_true',
+                        help="stop after convert_to_mp3's trimming")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="MP3 sections to build concurrently")
+    # trim_silence_inplace.py options the runner doesn't expose
+    parser.set_defaults(pipe=False, scratch_dir=None, lock=False)
+    args = parser.parse_args()
+    if args.threshold == 'auto' and args.detector == 'showinfo':
+        # Calibration uses the downscaled luma scores; showinfo scores full-size YUV
+        parser.error("--threshold auto is calibrated for the numpy/keyframes/bisect "
+                     "detectors; give showinfo an explicit threshold")
+
+    sections_dir = Path(args.sections_dir)
+    mp3_dir = Path(args.mp3_dir)
+    sections_dir.mkdir(exist_ok=True)
+    mp3_dir.mkdir(exist_ok=True)
+    store = FingerprintStore(mp3_dir / STORE_NAME)
+    report = {kind: [0, 0] for kind in ('wav', 'jpg', 'image copy', 'mp3')}  # [built, skipped]
+
+    print("=" * 60)
+    print("Step 1: Scene detection (cached by video content and parameters)")
+    print("=" * 60)
+    if args.threshold == 'auto':
+        threshold, _ = scene_detect.auto_threshold(args.video)
+    else:
+        threshold = float(args.threshold)
+    segments, _ = process_video.detect_scenes_cached(args.video, args.detector, threshold)
+    print(f"Found {len(segments)} sections")
+
+    print("\n" + "=" * 60)
+    print("Step 2: Section images and audio")
+    print("=" * 60)
+    sections = build_sections(args.video, segments, threshold, sections_dir, store, report)
+    summary_io.write_json_atomic(sections_dir / "sections_summary.json", sections)
+    store.save()
+
+    print("\n" + "=" * 60)
+    print("Step 3: MP3 encoding and trimming")
+    print("=" * 60)
+    mp3_sections = build_mp3s(sections, sections_dir, mp3_dir, args, store, report)
+    summary_io.write_json_atomic(mp3_dir / "sections_summary.json", mp3_sections)
+    store.save()
+
+    html_src = sections_dir / "index.html"
+    if html_src.exists():
+        with open(html_src, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+        html_content = html_content.replace('.wav"', '.mp3"')
+        html_content = html_content.replace('type="audio/wav"', 'type="audio/mpeg"')
+        with open(mp3_dir / "index.html", 'w', encoding='utf-8') as f:
+            f.write(html_content)
+
+    print("\n" + "=" * 60)
+    print("Done!")
+    for kind, (built, skipped) in report.items():
+        print(f"  {kind:<11} built {built:>4}, skipped {skipped:>4} (up to date)")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
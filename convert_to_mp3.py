@@ -3,16 +3,34 @@
 Convert WAV files to MP3 and trim beginning/ending silence conservatively.
 """
 
-import subprocess
+import os
 import json
 import re
+import shutil
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def detect_silence(wav_path, noise_db=-40, min_duration=0.3):
+import ffmpeg_jobs
+import media_probe
+import pcm_buffer
+import silence_analysis
+
+def detect_silence(wav_path, noise_db=-40, min_duration=0.3, backend='numpy', samples=None):
     """
     Detect silence in audio file.
-    Returns (start_trim, end_trim) in seconds to trim from beginning and end.
+    backend: 'numpy' analyzes the PCM in-process, 'ffmpeg' runs silencedetect
+    samples: the section's slice of the shared PCM map, read instead of wav_path
+    Returns (silence_starts, silence_ends) in seconds; a silence running to
+    the end of the file has no end.
     """
+    if backend == 'numpy':
+        silences = silence_analysis.detect_silences(wav_path, noise_db, min_duration,
+                                                    samples=samples, sample_rate=pcm_buffer.PCM_RATE)
+        silence_starts = [start for start, _ in silences]
+        silence_ends = [end for _, end in silences if end is not None]
+        return silence_starts, silence_ends
+    
     # Use ffmpeg silencedetect to find silence
     cmd = [
         'ffmpeg', '-i', wav_path,
@@ -20,7 +38,7 @@ def detect_silence(wav_path, noise_db=-40, min_duration=0.3):
         '-f', 'null', '-'
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = ffmpeg_jobs.run(cmd, text=True)
     output = result.stderr
     
     # Parse silence periods
@@ -41,32 +59,73 @@ def detect_silence(wav_path, noise_db=-40, min_duration=0.3):
 
 def get_audio_duration(wav_path):
     """Get audio duration in seconds"""
-    cmd = [
-        'ffprobe', '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        wav_path
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return float(result.stdout.strip())
+    return media_probe.get_duration(wav_path)
+
+def compute_trim(silence_starts, silence_ends, duration):
+    """
+    Conservative trim amounts from detected silence.
+    Returns (start_trim, end_trim) in seconds, each at most 30% of duration.
+    """
+    start_trim = 0
+    end_trim = 0
+    
+    # Trim from beginning if silence at start
+    if silence_starts and len(silence_ends) > 0:
+        # If silence starts at 0, trim it
+        if silence_starts[0] <= 0.1:  # Silence starts near beginning
+            start_trim = silence_ends[0]
+            # Be conservative - leave some padding
+            start_trim = max(0, start_trim - 0.1)
+    
+    # Trim from end if silence at end
+    if silence_starts and len(silence_starts) > len(silence_ends):
+        # Silence extends to end
+        end_trim = duration - silence_starts[-1]
+        # Be conservative - leave some padding
+        end_trim = max(0, end_trim - 0.1)
+    elif silence_ends and silence_ends[-1] < duration - 0.1:
+        # Check if there's silence at the end
+        if len(silence_starts) == len(silence_ends):
+            # Last silence period ends before the audio ends
+            # Check if the gap is significant
+            pass  # No trailing silence to trim
+    
+    # Conservative limits: don't trim more than 30% of audio
+    max_trim = duration * 0.3
+    start_trim = min(start_trim, max_trim)
+    end_trim = min(end_trim, max_trim)
+    
+    return start_trim, end_trim
+
+def checked_trim(start_trim, end_trim, duration):
+    """The trims, or (0, 0) if they would leave 0.5s of audio or less"""
+    if duration - start_trim - end_trim <= 0.5:
+        return 0, 0
+    return start_trim, end_trim
+
+def plan_trim(silence_starts, silence_ends, duration):
+    """
+    Trim this script applies to a section: compute_trim(), dropped by
+    checked_trim() if too little would be left. Returns (start_trim, end_trim).
+    """
+    start_trim, end_trim = compute_trim(silence_starts, silence_ends, duration)
+    return checked_trim(start_trim, end_trim, duration)
 
-def convert_to_mp3_trimmed(wav_path, mp3_path, start_trim=0, end_trim=0):
+def convert_to_mp3_trimmed(wav_path, mp3_path, start_trim=0, end_trim=0, duration=None):
     """
     Convert WAV to MP3 with optional trimming.
     start_trim: seconds to trim from beginning
     end_trim: seconds to trim from end
+    duration: duration of wav_path if already known
+    Returns (start_trim, end_trim, new_duration), or None if ffmpeg failed
     """
-    duration = get_audio_duration(wav_path)
+    if duration is None:
+        duration = get_audio_duration(wav_path)
     
-    # Calculate actual duration after trimming
+    # If trimming would leave very little audio, don't trim
+    start_trim, end_trim = checked_trim(start_trim, end_trim, duration)
     actual_duration = duration - start_trim - end_trim
     
-    if actual_duration <= 0.5:
-        # If trimming would leave very little audio, don't trim
-        start_trim = 0
-        end_trim = 0
-        actual_duration = duration
-    
     cmd = [
         'ffmpeg', '-y', '-i', wav_path,
         '-ss', str(start_trim),
@@ -76,98 +135,184 @@ def convert_to_mp3_trimmed(wav_path, mp3_path, start_trim=0, end_trim=0):
         mp3_path
     ]
     
-    subprocess.run(cmd, capture_output=True)
+    if ffmpeg_jobs.run(cmd).returncode != 0:
+        return None
     return start_trim, end_trim, actual_duration
 
+def process_section(section, input_dir, output_dir, args, previous):
+    """
+    Convert one section's WAV to a trimmed MP3.
+    Returns (new_section, log) where log holds the lines to print, so
+    concurrent sections don't interleave their output; new_section is None
+    if encoding failed.
+    """
+    section_num = section['section']
+    wav_path = input_dir / section['audio']
+    mp3_filename = f"section_{section_num:03d}.mp3"
+    mp3_path = output_dir / mp3_filename
+    
+    log = [f"\nProcessing Section {section_num}:"]
+    
+    # Detect silence, from the shared PCM map when process_video.py made one
+    samples = None
+    if args.silence_backend == 'numpy':
+        samples = pcm_buffer.section_samples(section, input_dir)
+    prev = previous.get((section['start_time'], section['end_time']), {})
+    noise_floor_db = prev.get('noise_floor_db')
+    noise_db = prev.get('silence_threshold_db')
+    if args.noise_db != 'auto':
+        noise_db = float(args.noise_db)
+    if noise_db is None:
+        # Estimate the noise floor in the same pass as the silence analysis
+        silences, noise_floor_db, noise_db = silence_analysis.detect_silences_auto(
+            str(wav_path), samples=samples, sample_rate=pcm_buffer.PCM_RATE)
+        silence_starts = [start for start, _ in silences]
+        silence_ends = [end for _, end in silences if end is not None]
+        log.append(f"  Noise floor: {noise_floor_db:.1f} dB -> threshold {noise_db:.1f} dB")
+    else:
+        silence_starts, silence_ends = detect_silence(str(wav_path), noise_db,
+                                                      backend=args.silence_backend,
+                                                      samples=samples)
+    duration = get_audio_duration(str(wav_path))
+    
+    # Determine trim amounts (conservative)
+    start_trim, end_trim = plan_trim(silence_starts, silence_ends, duration)
+    
+    log.append(f"  Original duration: {duration:.2f}s")
+    log.append(f"  Detected silence periods: {len(silence_starts)}")
+    log.append(f"  Trimming: start={start_trim:.2f}s, end={end_trim:.2f}s")
+    
+    # Convert and trim
+    converted = convert_to_mp3_trimmed(
+        str(wav_path), str(mp3_path), start_trim, end_trim, duration
+    )
+    if converted is None:
+        log.append(f"  ✗ Encoding {mp3_path} failed")
+        return None, log
+    actual_start, actual_end, new_duration = converted
+    
+    log.append(f"  New duration: {new_duration:.2f}s")
+    log.append(f"  Saved: {mp3_path}")
+    
+    # Copy image to new directory
+    img_src = input_dir / section['image']
+    img_dst = output_dir / section['image']
+    if not img_dst.exists():
+        shutil.copy(str(img_src), str(img_dst))
+    
+    new_section = {
+        'section': section_num,
+        'start_time': section['start_time'],
+        'end_time': section['end_time'],
+        'duration': new_duration,
+        'image': section['image'],
+        'audio': mp3_filename,
+        'trim_start': actual_start,
+        'trim_end': actual_end,
+        'original_duration': duration
+    }
+    # Keep detection parameters recorded by process_video.py
+    for key in ('scene_threshold', 'scene_threshold_margin'):
+        if key in section:
+            new_section[key] = section[key]
+    if 'pcm' in section:
+        pcm_path = input_dir / section['pcm']
+        new_section['pcm'] = os.path.relpath(pcm_path, output_dir)
+        new_section['pcm_start'] = section['pcm_start']
+        new_section['pcm_end'] = section['pcm_end']
+    if args.noise_db == 'auto':
+        new_section['noise_floor_db'] = noise_floor_db
+        new_section['silence_threshold_db'] = noise_db
+    
+    return new_section, log
+
+def kept_sections(sections, input_dir, output_dir):
+    """
+    MP3 records that process_video.py --reuse renamed to the new section
+    numbers, keyed by section number. Only honoured until this script has
+    written its summary since (the mapping is older than the summary then),
+    and only while interval and files still match.
+    """
+    mapping_path = input_dir / "section_mapping.json"
+    summary_path = output_dir / "sections_summary.json"
+    if not mapping_path.exists() or not summary_path.exists():
+        return {}
+    if mapping_path.stat().st_mtime_ns < summary_path.stat().st_mtime_ns:
+        return {}
+    with open(mapping_path, 'r', encoding='utf-8') as f:
+        kept_nums = {m['new'] for m in json.load(f)['mapping']}
+    with open(summary_path, 'r', encoding='utf-8') as f:
+        previous = {prev['section']: prev for prev in json.load(f)}
+    
+    kept = {}
+    for section in sections:
+        prev = previous.get(section['section'])
+        if section['section'] in kept_nums and prev is not None and \
+                (prev['start_time'], prev['end_time']) == (section['start_time'], section['end_time']) and \
+                (output_dir / prev['audio']).exists() and (output_dir / prev['image']).exists():
+            kept[section['section']] = prev
+    return kept
+
 def main():
-    input_dir = Path("output_sections")
-    output_dir = Path("output_sections_mp3")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--input-dir', default="output_sections")
+    parser.add_argument('--output-dir', default="output_sections_mp3")
+    parser.add_argument('--silence-backend', choices=['numpy', 'ffmpeg'], default='numpy',
+                        help="numpy: in-process PCM analysis (default); ffmpeg: silencedetect")
+    parser.add_argument('--noise-db', default='-40',
+                        help="silence threshold in dB, or 'auto' to place it relative to "
+                             "each file's estimated noise floor")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="sections to process concurrently")
+    args = parser.parse_args()
+    
+    input_dir = Path(args.input_dir)
+    output_dir = Path(args.output_dir)
     output_dir.mkdir(exist_ok=True)
     
     # Load sections data
     with open(input_dir / "sections_summary.json", 'r', encoding='utf-8') as f:
         sections = json.load(f)
     
+    # Noise estimates from a previous run, reused while the section is unchanged
+    previous = {}
+    previous_summary = output_dir / "sections_summary.json"
+    if args.noise_db == 'auto' and previous_summary.exists():
+        with open(previous_summary, 'r', encoding='utf-8') as f:
+            for prev in json.load(f):
+                previous[(prev['start_time'], prev['end_time'])] = prev
+    
+    # MP3s process_video.py --reuse kept for unchanged intervals
+    kept = kept_sections(sections, input_dir, output_dir)
+    
     print("=" * 60)
     print("Converting WAV to MP3 with silence trimming")
     print("=" * 60)
+    if kept:
+        print(f"Keeping {len(kept)} MP3s of sections unchanged since the last detection")
     
-    new_sections = []
+    new_sections = [kept.get(section['section']) for section in sections]
+    todo = [i for i, section in enumerate(sections) if section['section'] not in kept]
+    if args.jobs > 1:
+        # Longest sections first, so the last ones to finish are short
+        todo.sort(key=lambda i: -sections[i]['duration'])
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {
+                pool.submit(process_section, sections[i], input_dir, output_dir, args, previous): i
+                for i in todo
+            }
+            for future in as_completed(futures):
+                new_section, log = future.result()
+                print('\n'.join(log))
+                new_sections[futures[future]] = new_section
+    else:
+        for i in todo:
+            new_section, log = process_section(sections[i], input_dir, output_dir, args, previous)
+            print('\n'.join(log))
+            new_sections[i] = new_section
     
-    for section in sections:
-        section_num = section['section']
-        wav_path = input_dir / section['audio']
-        mp3_filename = f"section_{section_num:03d}.mp3"
-        mp3_path = output_dir / mp3_filename
-        
-        print(f"\nProcessing Section {section_num}:")
-        
-        # Detect silence
-        silence_starts, silence_ends = detect_silence(str(wav_path))
-        duration = get_audio_duration(str(wav_path))
-        
-        # Determine trim amounts (conservative)
-        start_trim = 0
-        end_trim = 0
-        
-        # Trim from beginning if silence at start
-        if silence_starts and len(silence_ends) > 0:
-            # If silence starts at 0, trim it
-            if silence_starts[0] <= 0.1:  # Silence starts near beginning
-                start_trim = silence_ends[0]
-                # Be conservative - leave some padding
-                start_trim = max(0, start_trim - 0.1)
-        
-        # Trim from end if silence at end
-        if silence_starts and len(silence_starts) > len(silence_ends):
-            # Silence extends to end
-            end_trim = duration - silence_starts[-1]
-            # Be conservative - leave some padding
-            end_trim = max(0, end_trim - 0.1)
-        elif silence_ends and silence_ends[-1] < duration - 0.1:
-            # Check if there's silence at the end
-            if len(silence_starts) == len(silence_ends):
-                # Last silence period ends before the audio ends
-                # Check if the gap is significant
-                pass  # No trailing silence to trim
-        
-        # Conservative limits: don't trim more than 30% of audio
-        max_trim = duration * 0.3
-        start_trim = min(start_trim, max_trim)
-        end_trim = min(end_trim, max_trim)
-        
-        print(f"  Original duration: {duration:.2f}s")
-        print(f"  Detected silence periods: {len(silence_starts)}")
-        print(f"  Trimming: start={start_trim:.2f}s, end={end_trim:.2f}s")
-        
-        # Convert and trim
-        actual_start, actual_end, new_duration = convert_to_mp3_trimmed(
-            str(wav_path), str(mp3_path), start_trim, end_trim
-        )
-        
-        print(f"  New duration: {new_duration:.2f}s")
-        print(f"  Saved: {mp3_path}")
-        
-        # Copy image to new directory
-        img_src = input_dir / section['image']
-        img_dst = output_dir / section['image']
-        if not img_dst.exists():
-            import shutil
-            shutil.copy(str(img_src), str(img_dst))
-        
-        new_sections.append({
-            'section': section_num,
-            'start_time': section['start_time'],
-            'end_time': section['end_time'],
-            'duration': new_duration,
-            'image': section['image'],
-            'audio': mp3_filename,
-            'trim_start': actual_start,
-            'trim_end': actual_end,
-            'original_duration': duration
-        })
-    
-    # Write updated summary
+    # Write updated summary, leaving out sections that failed to encode
+    new_sections = [s for s in new_sections if s is not None]
     summary_path = output_dir / "sections_summary.json"
     with open(summary_path, 'w', encoding='utf-8') as f:
         json.dump(new_sections, f, indent=2, ensure_ascii=False)
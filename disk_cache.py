@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Helpers for the on-disk caches kept next to the working directory.
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+CACHE_DIR = Path(os.environ.get("SECTIONS_CACHE_DIR", ".cache"))
+CACHE_MAX_BYTES = int(os.environ.get("SECTIONS_CACHE_MAX_BYTES", 256 << 20))
+HASH_CHUNK = 1 << 20  # Bytes hashed from the head, middle and tail of a file
+
+def fast_file_hash(path):
+    """
+    Content hash of a (possibly large) media file without reading all of it:
+    the file size plus 1 MiB from its start, middle and end.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= 3 * HASH_CHUNK:
+            h.update(f.read())
+        else:
+            for offset in (0, size // 2 - HASH_CHUNK // 2, size - HASH_CHUNK):
+                f.seek(offset)
+                h.update(f.read(HASH_CHUNK))
+    return h.hexdigest()
+
+def full_file_hash(path):
+    """Content hash of a whole (small) file"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(*parts):
+    """Stable short key for a tuple of JSON-serializable parameters"""
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def cache_path(kind, key, suffix, cache_dir=None):
+    """Path of a cache entry, creating its directory"""
+    d = Path(cache_dir or CACHE_DIR) / kind
+    d.mkdir(parents=True, exist_ok=True)
+    return d / f"{key}{suffix}"
+
+def touch(path):
+    """Mark a cache entry as recently used"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def lru_evict(cache_dir=None, max_bytes=CACHE_MAX_BYTES):
+    """
+    Delete least recently used entries (oldest mtime first) until the cache
+    directory fits in max_bytes. Returns the number of files removed.
+    """
+    entries = []
+    for path in Path(cache_dir or CACHE_DIR).rglob('*'):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        if path.is_file():
+            entries.append((st.st_mtime, st.st_size, path))
+    
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def load_json(kind, key, cache_dir=None):
+    """Cached JSON value, or None on a miss"""
+    path = cache_path(kind, key, '.json', cache_dir)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+    touch(path)
+    return value
+
+def store_json(kind, key, value, cache_dir=None):
+    """Write a JSON value atomically and keep the cache under its size cap"""
+    path = cache_path(kind, key, '.json', cache_dir)
+    tmp = path.with_suffix('.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    lru_evict(cache_dir)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+One event loop for all ffmpeg/ffprobe processes of a run.
+
+Jobs are started with asyncio.create_subprocess_exec on a loop running in a
+background thread, so any thread (a script's main loop or its worker pool)
+can submit them. A global semaphore caps how many run at once across all
+stages and videos, each job can have a timeout, and stderr can be handed to
+a callback line by line while the process is still running.
+
+Jobs whose stdout is consumed as it is produced (e.g. a rawvideo pipe read
+frame by frame) run through popen(), which holds a slot of the same
+semaphore around a plain Popen.
+"""
+
+import os
+import re
+import asyncio
+import threading
+import subprocess
+from contextlib import contextmanager
+
+MAX_JOBS = int(os.environ.get('FFMPEG_JOBS', 0)) or os.cpu_count() or 4
+DEFAULT_TIMEOUT = float(os.environ.get('FFMPEG_TIMEOUT', 0)) or None  # Seconds, None = no limit
+READ_SIZE = 1 << 16
+LINE_END = re.compile(r'[\r\n]')  # ffmpeg ends progress lines with \r
+
+_lock = threading.Lock()
+_loop = None
+_semaphore = None
+
+def _start_loop():
+    global _loop, _semaphore
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name='ffmpeg-jobs', daemon=True).start()
+            ready.wait()
+            _semaphore = asyncio.Semaphore(MAX_JOBS)
+            _loop = loop
+    return _loop
+
+async def _read_stderr(stream, on_line, chunks):
+    pending = ''
+    while True:
+        data = await stream.read(READ_SIZE)
+        if not data:
+            break
+        chunks.append(data)
+        if on_line is None:
+            continue
+        pending += data.decode('utf-8', errors='replace')
+        *lines, pending = LINE_END.split(pending)
+        for line in lines:
+            if line:
+                on_line(line)
+    if on_line is not None and pending:
+        on_line(pending)
+
+async def _feed_stdin(stream, data):
+    """Write input in chunks, waiting for the pipe to drain so nothing is copied whole"""
+    view = memoryview(data).cast('B')
+    try:
+        for pos in range(0, len(view), READ_SIZE):
+            stream.write(view[pos:pos + READ_SIZE])
+            await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stream.close()
+
+async def _run(cmd, timeout, on_stderr_line, input, text):
+    async with _semaphore:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        stderr_chunks = []
+        tasks = [proc.stdout.read(), _read_stderr(proc.stderr, on_stderr_line, stderr_chunks)]
+        if input is not None:
+            tasks.append(_feed_stdin(proc.stdin, input))
+        try:
+            results = await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+            await proc.wait()
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+
+    stdout, stderr = results[0], b''.join(stderr_chunks)
+    if text:
+        stdout = stdout.decode('utf-8', errors='replace')
+        stderr = stderr.decode('utf-8', errors='replace')
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+def submit(cmd, timeout=DEFAULT_TIMEOUT, on_stderr_line=None, input=None, text=False):
+    """
+    Queue a command and return a concurrent.futures.Future for its
+    subprocess.CompletedProcess (stdout and stderr captured).
+    on_stderr_line is called with each stderr line as it arrives, from the
+    loop thread. input (any bytes-like object) is streamed to stdin.
+    A job running longer than timeout is killed and raises TimeoutExpired.
+    """
+    loop = _start_loop()
+    cmd = [str(c) for c in cmd]
+    return asyncio.run_coroutine_threadsafe(
+        _run(cmd, timeout, on_stderr_line, input, text), loop)
+
+def run(cmd, timeout=DEFAULT_TIMEOUT, on_stderr_line=None, input=None, text=False):
+    """Blocking form of submit(): wait for the job and return its CompletedProcess"""
+    return submit(cmd, timeout, on_stderr_line, input, text).result()
+
+@contextmanager
+def popen(cmd, timeout=DEFAULT_TIMEOUT):
+    """
+    Context manager for a job whose stdout the caller reads itself: waits
+    for a slot, then yields a subprocess.Popen with stdout piped (stderr is
+    discarded). The slot is held until the block exits and the process has
+    been waited for. A job running longer than timeout is killed and raises
+    TimeoutExpired.
+    """
+    loop = _start_loop()
+    cmd = [str(c) for c in cmd]
+    asyncio.run_coroutine_threadsafe(_semaphore.acquire(), loop).result()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        timed_out = threading.Event()
+        
+        def kill():
+            timed_out.set()
+            proc.kill()
+        
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            yield proc
+        finally:
+            proc.stdout.close()
+            proc.wait()
+            if timer is not None:
+                timer.cancel()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+    finally:
+        loop.call_soon_threadsafe(_semaphore.release)
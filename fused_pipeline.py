@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Fused extract-trim-encode pipeline: video -> trimmed MP3 sections.
+
+Does the work of process_video.py, convert_to_mp3.py and
+trim_silence_inplace.py in one go. The audio track is decoded once into
+the shared PCM map; both scripts' trim rules (paddings, 30%/40% caps) are
+applied to the source PCM, and each final MP3 is encoded exactly once from
+the trimmed slice. No intermediate WAV or MP3 is re-decoded, so there is
+no generation loss.
+"""
+
+import json
+import argparse
+from pathlib import Path
+
+import convert_to_mp3
+import trim_silence_inplace
+import pcm_buffer
+from process_video import detect_scenes_cached, extract_still_images, DETECTORS
+
+def plan_section_trim(samples, sample_rate=pcm_buffer.PCM_RATE, noise_db=-40):
+    """
+    Final trim for one section, as the two scripts would apply it in turn.
+    1. convert_to_mp3.py rules on the whole section (0.3s silences)
+    2. trim_silence_inplace.py rules on what is left (0.2s silences)
+    Returns (trim_start, trim_end, original_duration, new_duration).
+    """
+    duration = len(samples) / sample_rate
+
+    # Stage 1: convert_to_mp3.py
+    silence_starts, silence_ends = convert_to_mp3.detect_silence(
+        None, noise_db, 0.3, samples=samples)
+    start_trim, end_trim = convert_to_mp3.plan_trim(silence_starts, silence_ends, duration)
+    stage_duration = duration - start_trim - end_trim
+
+    # Stage 2: trim_silence_inplace.py, on the stage 1 result
+    first = int(round(start_trim * sample_rate))
+    last = first + int(round(stage_duration * sample_rate))
+    silences = trim_silence_inplace.detect_silence_full(
+        None, noise_db, 0.2, samples=samples[first:last])
+    trim_start, trim_end = trim_silence_inplace.plan_trim(silences, stage_duration)
+
+    total_start = start_trim + trim_start
+    total_end = end_trim + trim_end
+    return total_start, total_end, duration, duration - total_start - total_end
+
+def run_fused(video_path, output_dir, threshold=0.02, detector='numpy', use_cache=True):
+    """Run the whole pipeline for one video and return the section records"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True)
+
+    segments, _ = detect_scenes_cached(video_path, detector, threshold, use_cache)
+    print(f"Found {len(segments)} sections")
+
+    img_paths = [output_dir / f"section_{i+1:03d}.jpg" for i in range(len(segments))]
+    extract_still_images(video_path, [start + 0.3 for start, _ in segments], img_paths)
+
+    print(f"\nDecoding audio once to {pcm_buffer.PCM_NAME}...")
+    pcm_path = output_dir / pcm_buffer.PCM_NAME
+    pcm = pcm_buffer.decode_audio(video_path, pcm_path)
+
+    sections = []
+    for i, (start, end) in enumerate(segments):
+        section_num = i + 1
+        first, last = pcm_buffer.sample_range(start, end)
+        samples = pcm[first:last]
+        trim_start, trim_end, duration, new_duration = plan_section_trim(samples)
+
+        mp3_filename = f"section_{section_num:03d}.mp3"
+        keep_first = first + int(round(trim_start * pcm_buffer.PCM_RATE))
+        keep_last = keep_first + int(round(new_duration * pcm_buffer.PCM_RATE))
+        if pcm_buffer.encode_mp3(pcm[keep_first:keep_last], output_dir / mp3_filename) != 0:
+            raise RuntimeError(f"Encoding {output_dir / mp3_filename} failed")
+
+        print(f"\nSection {section_num} ({start:.1f}s - {end:.1f}s):")
+        print(f"  Trimming: start={trim_start:.2f}s, end={trim_end:.2f}s")
+        print(f"  Duration: {duration:.2f}s -> {new_duration:.2f}s")
+
+        sections.append({
+            'section': section_num,
+            'start_time': start,
+            'end_time': end,
+            'duration': new_duration,
+            'image': img_paths[i].name,
+            'audio': mp3_filename,
+            'trim_start': trim_start,
+            'trim_end': trim_end,
+            'original_duration': duration,
+            'scene_threshold': threshold
+        })
+
+    del pcm
+    pcm_path.unlink()
+
+    summary_path = output_dir / "sections_summary.json"
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(sections, f, indent=2, ensure_ascii=False)
+    return sections
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='?', default="吴语上丽片-松阳话 [BV1icCyYAEr5].mp4")
+    parser.add_argument('--output-dir', default="output_sections_mp3")
+    parser.add_argument('--threshold', type=float, default=0.02)
+    parser.add_argument('--detector', choices=sorted(DETECTORS), default='numpy')
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Fused pipeline: detect, trim and encode each section once")
+    print("=" * 60)
+
+    sections = run_fused(args.video, args.output_dir, args.threshold, args.detector,
+                         not args.no_cache)
+
+    total_original = sum(s['original_duration'] for s in sections)
+    total_new = sum(s['duration'] for s in sections)
+    print("\n" + "=" * 60)
+    print("Done!")
+    print(f"Total duration: {total_original:.1f}s -> {total_new:.1f}s")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Single-call media probing shared by all scripts.
+
+One `ffprobe -show_format -show_streams -of json` per file gives everything
+the scripts need (dimensions, duration, audio format). Results are memoized
+by (path, size, mtime) in memory and in a JSON file in the cache directory,
+so unchanged files are never probed twice, even across runs.
+"""
+
+import os
+import json
+import atexit
+import threading
+from typing import NamedTuple, Optional
+
+from disk_cache import CACHE_DIR
+import ffmpeg_jobs
+
+PROBE_CACHE = CACHE_DIR / "probe.json"
+
+class MediaInfo(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    duration: float
+    start_time: float
+    format_name: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    video_codec: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    audio_codec: Optional[str] = None
+
+_lock = threading.Lock()
+_memo = None  # abspath -> MediaInfo, loaded lazily from PROBE_CACHE
+_dirty = False
+
+def _parse_rate(rate):
+    """'30000/1001' -> 29.97"""
+    try:
+        num, den = rate.split('/')
+        return float(num) / float(den) if float(den) else None
+    except (AttributeError, ValueError):
+        return None
+
+def _load_memo():
+    global _memo
+    if _memo is None:
+        _memo = {}
+        try:
+            with open(PROBE_CACHE, 'r', encoding='utf-8') as f:
+                for path, fields in json.load(f).items():
+                    _memo[path] = MediaInfo(**fields)
+        except (OSError, ValueError, TypeError):
+            pass
+    return _memo
+
+def save_memo():
+    """Persist new probe results; also runs at interpreter exit"""
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        _dirty = False
+    PROBE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = PROBE_CACHE.with_suffix(f'.{os.getpid()}.tmp')
+    with _lock:
+        entries = {p: info._asdict() for p, info in _memo.items()}
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False)
+    os.replace(tmp, PROBE_CACHE)
+
+atexit.register(save_memo)
+
+def run_ffprobe(path):
+    """Probe a file with one ffprobe call and return a MediaInfo"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_format', '-show_streams',
+        '-of', 'json',
+        str(path)
+    ]
+    result = ffmpeg_jobs.run(cmd, text=True)
+    data = json.loads(result.stdout or '{}')
+    if 'format' not in data:
+        raise ValueError(f"ffprobe failed on {path}: {result.stderr.strip()}")
+    fmt = data['format']
+    st = os.stat(path)
+
+    fields = {
+        'path': os.path.abspath(path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'duration': float(fmt.get('duration', 0) or 0),
+        'start_time': float(fmt.get('start_time', 0) or 0),
+        'format_name': fmt.get('format_name', ''),
+    }
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind == 'video' and 'width' not in fields:
+            fields['width'] = int(stream['width'])
+            fields['height'] = int(stream['height'])
+            fields['fps'] = _parse_rate(stream.get('avg_frame_rate')) or \
+                _parse_rate(stream.get('r_frame_rate'))
+            fields['video_codec'] = stream.get('codec_name')
+        elif kind == 'audio' and 'sample_rate' not in fields:
+            fields['sample_rate'] = int(stream.get('sample_rate', 0) or 0)
+            fields['channels'] = int(stream.get('channels', 0) or 0)
+            fields['audio_codec'] = stream.get('codec_name')
+    return MediaInfo(**fields)
+
+def probe(path):
+    """
+    Memoized probe of a media file.
+    Returns the cached MediaInfo while the file's size and mtime are unchanged.
+    """
+    global _dirty
+    abspath = os.path.abspath(path)
+    st = os.stat(abspath)
+    with _lock:
+        info = _load_memo().get(abspath)
+    if info is not None and info.size == st.st_size and info.mtime_ns == st.st_mtime_ns:
+        return info
+
+    info = run_ffprobe(abspath)
+    with _lock:
+        _memo[abspath] = info
+        _dirty = True
+    return info
+
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def read_wav_duration(path):
+    """
+    Duration from the RIFF header (data chunk size / byte rate), or None if
+    the header is missing or was never finalized.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        byte_rate = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id = chunk[:4]
+            size = int.from_bytes(chunk[4:8], 'little')
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                byte_rate = int.from_bytes(fmt[8:12], 'little')
+                size = 0
+            elif chunk_id == b'data':
+                if not byte_rate or size in (0, 0xFFFFFFFF):
+                    return None
+                return size / byte_rate
+            f.seek(size + (size & 1), 1)  # Chunks are padded to even size
+
+def read_mp3_duration(path):
+    """
+    Duration from the Xing/Info header of the first MP3 frame (as written by
+    LAME/ffmpeg): frame count * samples per frame / sample rate, the same value
+    ffprobe reports. None for files without such a header (e.g. plain CBR).
+    """
+    with open(path, 'rb') as f:
+        data = f.read(16384)
+        offset = 0
+        if data[:3] == b'ID3' and len(data) >= 10:
+            size = 0
+            for b in data[6:10]:
+                size = (size << 7) | (b & 0x7F)
+            offset = 10 + size + (10 if data[5] & 0x10 else 0)
+            if offset + 4096 > len(data):
+                f.seek(offset)
+                data = f.read(4096)
+                offset = 0
+
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 3
+    layer = (b1 >> 1) & 3
+    rate_idx = (b2 >> 2) & 3
+    if version == 1 or layer != 1 or rate_idx == 3:
+        return None  # Reserved version, not Layer III, or bad sample rate
+    sample_rate = MP3_SAMPLE_RATES[version][rate_idx]
+    mono = (b3 >> 6) == 3
+    if version == 3:
+        samples_per_frame = 1152
+        side_info = 17 if mono else 32
+    else:
+        samples_per_frame = 576
+        side_info = 9 if mono else 17
+
+    tag = offset + 4 + side_info
+    if data[tag:tag + 4] not in (b'Xing', b'Info'):
+        return None
+    flags = int.from_bytes(data[tag + 4:tag + 8], 'big')
+    if not flags & 1:
+        return None
+    frames = int.from_bytes(data[tag + 8:tag + 12], 'big')
+    return frames * samples_per_frame / sample_rate
+
+HEADER_READERS = {
+    '.wav': read_wav_duration,
+    '.mp3': read_mp3_duration,
+}
+
+def get_duration(path):
+    """
+    Duration in seconds, read from the file header for WAV and LAME MP3 files
+    and from a (memoized) ffprobe otherwise.
+    """
+    reader = HEADER_READERS.get(os.path.splitext(str(path))[1].lower())
+    if reader is not None:
+        try:
+            duration = reader(path)
+        except (OSError, IndexError):
+            duration = None
+        if duration is not None:
+            return duration
+    return probe(path).duration
+
+def main():
+    import sys
+    import time
+
+    paths = sys.argv[1:]
+    if not paths:
+        print("usage: media_probe.py FILE... (benchmarks header parsing vs ffprobe)")
+        return
+
+    rows = []
+    for path in paths:
+        reader = HEADER_READERS.get(os.path.splitext(path)[1].lower())
+        t0 = time.perf_counter()
+        header = reader(path) if reader else None
+        t1 = time.perf_counter()
+        probed = run_ffprobe(path).duration
+        t2 = time.perf_counter()
+        rows.append((path, header, probed, t1 - t0, t2 - t1))
+
+    print(f"{'file':<40} {'header':>10} {'ffprobe':>10} {'header us':>10} {'ffprobe us':>11}")
+    for path, header, probed, t_header, t_probe in rows:
+        header_str = f"{header:.4f}" if header is not None else "-"
+        print(f"{os.path.basename(path):<40} {header_str:>10} {probed:>10.4f} "
+              f"{t_header * 1e6:>10.0f} {t_probe * 1e6:>11.0f}")
+    n = len(rows)
+    print(f"\nMean per file: header {sum(r[3] for r in rows) / n * 1e6:.0f} us, "
+          f"ffprobe {sum(r[4] for r in rows) / n * 1e6:.0f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Lossless MP3 trimming by copying whole frames.
+
+The cut is made on frame boundaries and the exact start/end are restored
+with the encoder delay/padding fields of the LAME tag in the Xing/Info
+frame, which decoders (ffmpeg, LAME, most players) use for gapless
+playback. Nothing is decoded or re-encoded, so repeated trims lose no
+quality.
+"""
+
+DECODER_DELAY = 529  # Samples the MP3 decoder adds in front (ffmpeg: 528 + 1)
+LAME_DELAY = 576  # Encoder delay of libmp3lame, recorded in the LAME tag
+LAME_ENCODERS = (b'LAME', b'Lavf', b'Lavc')  # Tags whose delay/padding ffmpeg honours
+MAX_TAG_VALUE = 4095  # Delay and padding are 12-bit fields
+
+BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2
+}
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _crc16_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC16_TABLE = _crc16_table()
+
+def crc16(data, crc=0):
+    """CRC-16 (poly 0x8005, reflected) as used in the LAME tag"""
+    table = CRC16_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+def parse_header(data, offset):
+    """
+    Layer III frame header at offset, or None.
+    Returns dict with size, sample_rate, samples (per frame) and side_info.
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = (b1 >> 3) & 3
+    layer = (b1 >> 1) & 3
+    bitrate_idx = b2 >> 4
+    rate_idx = (b2 >> 2) & 3
+    if version == 1 or layer != 1 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    sample_rate = SAMPLE_RATES[version][rate_idx]
+    bitrate = BITRATES[3 if version == 3 else 2][bitrate_idx] * 1000
+    padding = (b2 >> 1) & 1
+    mono = (b3 >> 6) == 3
+    crc = 0 if b1 & 1 else 2
+    if version == 3:
+        samples = 1152
+        size = 144 * bitrate // sample_rate + padding
+        side_info = 17 if mono else 32
+    else:
+        samples = 576
+        size = 72 * bitrate // sample_rate + padding
+        side_info = 9 if mono else 17
+    return {
+        'size': size,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'side_info': side_info,
+        'side_offset': 4 + crc,
+        'main_data_bits': 9 if version == 3 else 8,
+    }
+
+def is_trailer(data):
+    """True if data is empty or only an APEv2 tag and/or an ID3v1 tag"""
+    if len(data) >= 128 and data[-128:-125] == b'TAG':
+        data = data[:-128]
+    if len(data) >= 32 and data[-32:-24] == b'APETAGEX':
+        size = int.from_bytes(data[-20:-16], 'little')  # Items and footer
+        has_header = int.from_bytes(data[-12:-8], 'little') >> 31
+        if len(data) == size + 32 * has_header:
+            data = b''
+    return not data
+
+class Mp3Stream:
+    """Frame layout of an MP3 file: tags, the Xing/Info frame and audio frames"""
+
+    def __init__(self, data):
+        self.data = data
+        offset = 0
+        if data[:3] == b'ID3' and len(data) >= 10:
+            size = 0
+            for b in data[6:10]:
+                size = (size << 7) | (b & 0x7F)
+            offset = 10 + size + (10 if data[5] & 0x10 else 0)
+        self.audio_start = offset
+
+        self.frames = []  # (offset, header) of every audio frame
+        self.info_offset = None
+        while True:
+            header = parse_header(data, offset)
+            if header is None or offset + header['size'] > len(data):
+                break
+            tag = offset + header['side_offset'] + header['side_info']
+            if not self.frames and self.info_offset is None and \
+                    data[tag:tag + 4] in (b'Xing', b'Info'):
+                self.info_offset = offset
+                self.info_header = header
+            else:
+                self.frames.append((offset, header))
+            offset += header['size']
+        self.audio_end = offset  # The trailer after this (e.g. ID3v1) is kept as is
+        # False if parsing stopped at something that isn't a tag (junk, a
+        # truncated or free-format frame): frames after it would be missed
+        self.complete = is_trailer(data[offset:])
+
+        self.lame = None
+        if self.info_offset is not None:
+            self._parse_info()
+
+    def _parse_info(self):
+        data, header = self.data, self.info_header
+        tag = self.info_offset + header['side_offset'] + header['side_info']
+        flags = int.from_bytes(data[tag + 4:tag + 8], 'big')
+        pos = tag + 8
+        self.xing_flags = flags
+        self.xing_frames_pos = pos if flags & 1 else None
+        pos += 4 if flags & 1 else 0
+        self.xing_bytes_pos = pos if flags & 2 else None
+        pos += 4 if flags & 2 else 0
+        self.xing_toc_pos = pos if flags & 4 else None
+        pos += 100 if flags & 4 else 0
+        pos += 4 if flags & 8 else 0
+        # Only a real LAME tag carries delay/padding that decoders apply
+        if pos + 36 <= self.info_offset + header['size'] and \
+                data[pos:pos + 4] in LAME_ENCODERS:
+            delay_pad = int.from_bytes(data[pos + 21:pos + 24], 'big')
+            self.lame = pos
+            self.enc_delay = delay_pad >> 12
+            self.enc_padding = delay_pad & 0xFFF
+
+    @property
+    def sample_rate(self):
+        return self.frames[0][1]['sample_rate']
+
+    @property
+    def samples_per_frame(self):
+        return self.frames[0][1]['samples']
+
+    def main_data_begin(self, index):
+        """Bytes of the bit reservoir frame `index` reads from earlier frames"""
+        offset, header = self.frames[index]
+        side = offset + header['side_offset']
+        value = int.from_bytes(self.data[side:side + 2], 'big')
+        return value >> (16 - header['main_data_bits'])
+
+    def payload(self, index):
+        """Main data bytes carried by frame `index`"""
+        _, header = self.frames[index]
+        return header['size'] - header['side_offset'] - header['side_info']
+
+    def build(self, first, last, enc_delay, enc_padding):
+        """
+        New file with frames [first, last) and the given gapless values:
+        original tags, then a patched copy of the Info frame.
+        """
+        body = b''.join(self.data[o:o + h['size']] for o, h in self.frames[first:last])
+        info = bytearray(self.data[self.info_offset:self.info_offset + self.info_header['size']])
+        base = self.info_offset
+        n_frames = last - first
+        total_bytes = len(info) + len(body)
+
+        if self.xing_frames_pos is not None:
+            info[self.xing_frames_pos - base:self.xing_frames_pos - base + 4] = n_frames.to_bytes(4, 'big')
+        if self.xing_bytes_pos is not None:
+            info[self.xing_bytes_pos - base:self.xing_bytes_pos - base + 4] = total_bytes.to_bytes(4, 'big')
+        if self.xing_toc_pos is not None:
+            # Seek table: byte position (of 256) at every percent of duration
+            toc = bytearray(100)
+            offsets = [0]
+            for o, h in self.frames[first:last]:
+                offsets.append(offsets[-1] + h['size'])
+            for i in range(100):
+                pos = len(info) + offsets[min(n_frames, i * n_frames // 100)]
+                toc[i] = min(255, pos * 256 // total_bytes)
+            info[self.xing_toc_pos - base:self.xing_toc_pos - base + 100] = toc
+
+        lame = self.lame - base
+        info[lame + 21:lame + 24] = ((enc_delay << 12) | enc_padding).to_bytes(3, 'big')
+        info[lame + 28:lame + 32] = total_bytes.to_bytes(4, 'big')
+        info[lame + 32:lame + 34] = crc16(body).to_bytes(2, 'big')
+        info[lame + 34:lame + 36] = crc16(info[:lame + 34]).to_bytes(2, 'big')
+
+        return self.data[:self.audio_start] + bytes(info) + body + self.data[self.audio_end:]
+
+def reservoir_start(stream, index):
+    """First frame whose main data frame `index` depends on"""
+    needed = stream.main_data_begin(index)
+    while needed > 0 and index > 0:
+        index -= 1
+        needed -= stream.payload(index)
+    return index
+
+def plan_cut(stream, start_sec, duration_sec):
+    """
+    Frames to keep and gapless values for a cut, or None when the cut can't
+    be expressed exactly (no LAME tag, frames the parser couldn't follow, or
+    delay/padding out of 12-bit range). Returns (first, last, enc_delay, enc_padding).
+    """
+    if stream.lame is None or not stream.frames or not stream.complete:
+        return None
+    sr = stream.sample_rate
+    spf = stream.samples_per_frame
+    n = len(stream.frames)
+
+    # Positions in the decoded sample stream of the original frames
+    start_skip = stream.enc_delay + DECODER_DELAY
+    audible_end = n * spf - stream.enc_padding + DECODER_DELAY
+    cut_start = start_skip + int(round(start_sec * sr))
+    cut_end = min(audible_end, cut_start + int(round(duration_sec * sr)))
+    if cut_end <= cut_start:
+        return None
+
+    # The frame holding cut_start needs its predecessor for the MDCT overlap,
+    # and both need the earlier frames their bit reservoir points into
+    target = min(n - 1, cut_start // spf)
+    first = min(reservoir_start(stream, k) for k in {max(0, target - 1), target})
+    last = min(n, (cut_end - 1) // spf + 1)
+
+    enc_delay = cut_start - first * spf - DECODER_DELAY
+    enc_padding = (last - first) * spf + DECODER_DELAY - (cut_end - first * spf)
+    if not (0 <= enc_delay <= MAX_TAG_VALUE and 0 <= enc_padding <= MAX_TAG_VALUE):
+        return None
+    return first, last, enc_delay, enc_padding
+
+def cut_bytes(mp3_path, start_sec, duration_sec):
+    """
+    The [start_sec, start_sec + duration_sec) part of mp3_path as a new MP3
+    in memory, or None if the file has no LAME tag or the cut can't be made
+    sample-accurate.
+    """
+    with open(mp3_path, 'rb') as f:
+        stream = Mp3Stream(f.read())
+    plan = plan_cut(stream, start_sec, duration_sec)
+    if plan is None:
+        return None
+    return stream.build(*plan)
+
+def trim_lossless(mp3_path, output_path, start_sec, duration_sec):
+    """
+    Write the [start_sec, start_sec + duration_sec) part of mp3_path to
+    output_path by copying frames. Returns False (writing nothing) if the
+    file has no LAME tag or the cut can't be made sample-accurate.
+    """
+    data = cut_bytes(mp3_path, start_sec, duration_sec)
+    if data is None:
+        return False
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return True
+
+def add_info_frame(data, n_samples, enc_delay=LAME_DELAY):
+    """
+    Give an MP3 written to a pipe the Xing/Info frame with LAME tag that
+    ffmpeg only writes to seekable outputs: frame count, byte count, seek
+    table and the gapless delay/padding for n_samples of audio.
+    The padding is clamped to what the tag can hold, so a sample count the
+    frames can't match (e.g. more than they contain) still gets a header,
+    just a less exact end. Returns data unchanged if it already has one or
+    isn't a plain run of frames the header could describe.
+    """
+    stream = Mp3Stream(data)
+    if stream.info_offset is not None or not stream.frames or not stream.complete:
+        return data
+    offset, header = stream.frames[0]
+    padding = len(stream.frames) * header['samples'] - enc_delay - n_samples
+    padding = min(max(padding, 0), MAX_TAG_VALUE)
+
+    # Same version, rate and channel mode as the audio, no CRC, and the
+    # smallest bitrate whose frame holds the Xing fields and the LAME tag
+    needed = 4 + header['side_info'] + 120 + 36
+    b1 = data[offset + 1] | 1
+    for bitrate_idx in range(1, 15):
+        frame_header = bytes((0xFF, b1, (bitrate_idx << 4) | (data[offset + 2] & 0x0D),
+                              data[offset + 3]))
+        info_header = parse_header(frame_header, 0)
+        if info_header['size'] >= needed:
+            break
+    info = bytearray(info_header['size'])
+    info[:4] = frame_header
+    tag = 4 + info_header['side_info']
+    info[tag:tag + 8] = b'Xing' + (0x0F).to_bytes(4, 'big')  # Frames, bytes, TOC, quality
+    lame = tag + 120
+    info[lame:lame + 9] = b'LAME3.100'
+
+    data = data[:stream.audio_start] + bytes(info) + data[stream.audio_start:]
+    stream = Mp3Stream(data)
+    return stream.build(0, len(stream.frames), enc_delay, padding)
+
+def gapless_samples(mp3_path):
+    """
+    Samples a gapless decoder plays after encoder delay/padding, as
+    (samples, sample_rate), or None without a LAME tag or with frames the
+    parser couldn't follow
+    """
+    with open(mp3_path, 'rb') as f:
+        stream = Mp3Stream(f.read())
+    if stream.lame is None or not stream.frames or not stream.complete:
+        return None
+    samples = len(stream.frames) * stream.samples_per_frame - stream.enc_delay - stream.enc_padding
+    return samples, stream.sample_rate
+
+def gapless_duration(mp3_path):
+    """Playback duration after encoder delay/padding, or None without a LAME tag"""
+    gapless = gapless_samples(mp3_path)
+    if gapless is None:
+        return None
+    samples, sample_rate = gapless
+    return samples / sample_rate
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Decode a video's audio track once into a raw int16 file and work on it
+through a NumPy memory map.
+
+Section WAVs are written from zero-copy slices of the map, and the silence
+analysis in the later stages reads the same file. Worker processes open the
+map by path, so the pages are shared through the OS page cache and peak RSS
+stays flat however long the video is.
+"""
+
+import os
+import wave
+import numpy as np
+
+import ffmpeg_jobs
+import mp3_frames
+
+PCM_RATE = 48000  # Same format as the section WAVs
+PCM_CHANNELS = 2
+PCM_NAME = "source_audio.s16le"
+
+def decode_audio(video_path, pcm_path, sample_rate=PCM_RATE, channels=PCM_CHANNELS):
+    """Decode the whole audio track to raw s16le in one ffmpeg run"""
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error', '-i', str(video_path),
+        '-vn',
+        '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(sample_rate),
+        '-ac', str(channels),
+        str(pcm_path)
+    ]
+    result = ffmpeg_jobs.run(cmd, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Decoding audio of {video_path} failed: {result.stderr.strip()}")
+    return open_pcm(pcm_path, channels)
+
+def decode_audio_array(video_path, sample_rate=PCM_RATE, channels=PCM_CHANNELS):
+    """Decode the whole audio track into memory as an (n_samples, channels) array"""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', str(video_path),
+        '-vn',
+        '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(sample_rate),
+        '-ac', str(channels),
+        '-'
+    ]
+    result = ffmpeg_jobs.run(cmd)
+    if result.returncode != 0:
+        raise RuntimeError(f"Decoding audio of {video_path} failed: {result.stderr.strip()}")
+    pcm = np.frombuffer(result.stdout, dtype='<i2')
+    return pcm[:len(pcm) // channels * channels].reshape(-1, channels)
+
+def open_pcm(pcm_path, channels=PCM_CHANNELS):
+    """Read-only map of a raw s16le file as an (n_samples, channels) array"""
+    if os.path.getsize(pcm_path) == 0:
+        return np.zeros((0, channels), dtype='<i2')
+    pcm = np.memmap(pcm_path, dtype='<i2', mode='r')
+    return pcm[:len(pcm) // channels * channels].reshape(-1, channels)
+
+def sample_range(start_sec, end_sec, sample_rate=PCM_RATE):
+    """Sample indices [first, last) covering a time range"""
+    return int(round(start_sec * sample_rate)), int(round(end_sec * sample_rate))
+
+def write_wav(path, samples, sample_rate=PCM_RATE):
+    """Write an int16 (n, channels) array as a WAV without copying it"""
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(memoryview(np.ascontiguousarray(samples)).cast('B'))
+
+def write_sections(pcm, segments, output_paths, sample_rate=PCM_RATE):
+    """
+    Write one WAV per segment from slices of the decoded audio.
+    Returns the (first, last) sample range of each segment.
+    """
+    ranges = []
+    for (start, end), output_path in zip(segments, output_paths):
+        first, last = sample_range(start, end, sample_rate)
+        write_wav(output_path, pcm[first:last], sample_rate)
+        ranges.append((first, min(last, len(pcm))))
+        print(f"  Audio: {output_path}")
+    return ranges
+
+def section_samples(section, base_dir):
+    """
+    Slice of the shared PCM map for a section record, or None if the record
+    has no map or the file is gone. For trimmed MP3 records the slice is
+    advanced by the trim already applied, so it lines up with the MP3.
+    """
+    if 'pcm' not in section:
+        return None
+    pcm_path = os.path.join(str(base_dir), section['pcm'])
+    if not os.path.exists(pcm_path):
+        return None
+    pcm = open_pcm(pcm_path)
+    first, last = section['pcm_start'], section['pcm_end']
+    if 'trim_start' in section:
+        first += int(round(section['trim_start'] * PCM_RATE))
+        last = min(last, first + int(round(section['duration'] * PCM_RATE)))
+    return pcm[first:last]
+
+def encode_mp3(samples, mp3_path, sample_rate=PCM_RATE, quality='2'):
+    """
+    Encode an int16 (n, channels) array to MP3 with libmp3lame, feeding the
+    samples to ffmpeg's stdin straight from the array's memory.
+    Returns ffmpeg's exit code.
+    """
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', str(samples.shape[1]),
+        '-i', '-',
+        '-codec:a', 'libmp3lame',
+        '-q:a', quality,
+        str(mp3_path)
+    ]
+    return ffmpeg_jobs.run(cmd, input=np.ascontiguousarray(samples)).returncode
+
+def encode_mp3_bytes(samples, sample_rate=PCM_RATE, quality='2'):
+    """
+    Encode an int16 (n, channels) array to MP3 in memory, through ffmpeg's
+    stdin and stdout. A piped MP3 has no Xing/LAME header (ffmpeg can't seek
+    back to write it), so decode it with decode_mp3_bytes.
+    """
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', str(samples.shape[1]),
+        '-i', '-',
+        '-codec:a', 'libmp3lame',
+        '-q:a', quality,
+        '-f', 'mp3', '-'
+    ]
+    result = ffmpeg_jobs.run(cmd, input=np.ascontiguousarray(samples))
+    if result.returncode != 0:
+        raise RuntimeError(f"Encoding MP3 failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+def decode_mp3_bytes(data, n_samples, sample_rate=PCM_RATE, channels=PCM_CHANNELS):
+    """
+    Decode an in-memory MP3 from encode_mp3_bytes back to int16 samples.
+    Without a LAME tag the decoder can't drop the encoder and decoder delay
+    or the end padding itself, so the known n_samples are cut out here,
+    giving what a gapless decoder plays.
+    """
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'mp3', '-i', '-',
+        '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(sample_rate),
+        '-ac', str(channels),
+        '-'
+    ]
+    result = ffmpeg_jobs.run(cmd, input=data)
+    pcm = np.frombuffer(result.stdout, dtype='<i2')
+    pcm = pcm[:len(pcm) // channels * channels].reshape(-1, channels)
+    skip = mp3_frames.LAME_DELAY + mp3_frames.DECODER_DELAY
+    return pcm[skip:skip + n_samples]
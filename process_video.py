@@ -7,30 +7,42 @@ Process video composed of still images:
 3. Extract (still image, accompanying audio wav) pairs
 """
 
-import subprocess
 import os
 import json
 import re
+import queue
+import argparse
 from pathlib import Path
 
-def detect_scenes_upper_half(video_path, threshold=0.02):
+from scene_detect import (detect_scenes_numpy, detect_scenes_keyframes, detect_scenes_bisect,
+                          auto_threshold, DETECTOR_VERSION, UPPER_HALF_CROP, MIN_SEGMENT)
+import disk_cache
+import ffmpeg_jobs
+import media_probe
+import pcm_buffer
+import summary_io
+
+DETECTORS = {
+    'showinfo': lambda path, threshold, use_cache: detect_scenes_upper_half(path, threshold),
+    'numpy': lambda path, threshold, use_cache: detect_scenes_numpy(path, threshold, use_cache=use_cache),
+    'keyframes': lambda path, threshold, use_cache: detect_scenes_keyframes(path, threshold),
+    'bisect': lambda path, threshold, use_cache: detect_scenes_bisect(path, threshold),
+}
+
+def stream_scenes_upper_half(video_path, threshold=0.02, min_duration=MIN_SEGMENT):
     """
     Use ffmpeg's scene detection on upper half only to find scene changes.
     This ignores buttons/animations in the lower half of the screen.
     threshold: scene change threshold (0.0-1.0), lower = more sensitive
+    Yields (start, end) segments while ffmpeg is still running: a section is
+    complete as soon as the next scene change is reported, and the last one
+    ends at the probed duration.
     """
     print("Analyzing video for scene changes (upper half only)...")
     
-    # First get video dimensions
-    cmd = [
-        'ffprobe', '-v', 'error',
-        '-select_streams', 'v:0',
-        '-show_entries', 'stream=width,height',
-        '-of', 'csv=s=x:p=0',
-        video_path
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    width, height = map(int, result.stdout.strip().split('x'))
+    # First get video dimensions (and duration, from the same probe)
+    info = media_probe.probe(video_path)
+    width, height = info.width, info.height
     print(f"Video dimensions: {width}x{height}")
     print(f"Analyzing upper half: {width}x{height//2}")
     
@@ -43,38 +55,61 @@ def detect_scenes_upper_half(video_path, threshold=0.02):
         '-f', 'null', '-'
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    output = result.stderr
+    # showinfo lines are handed over as ffmpeg prints them; None marks the end
+    lines = queue.Queue()
+    job = ffmpeg_jobs.submit(cmd, on_stderr_line=lines.put)
+    job.add_done_callback(lambda _: lines.put(None))
     
-    # Parse scene change timestamps
-    scene_times = [0.0]  # Start at 0
-    
-    for line in output.split('\n'):
+    # Parse scene change timestamps, filtering very short sections
+    start = 0.0
+    while True:
+        line = lines.get()
+        if line is None:
+            break
         if 'pts_time:' in line:
             match = re.search(r'pts_time:\s*([\d.]+)', line)
             if match:
                 time_sec = float(match.group(1))
-                scene_times.append(time_sec)
-    
-    # Get video duration
-    duration_cmd = [
-        'ffprobe', '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ]
-    duration_result = subprocess.run(duration_cmd, capture_output=True, text=True)
-    duration = float(duration_result.stdout.strip())
-    scene_times.append(duration)
+                if time_sec - start >= min_duration:
+                    yield start, time_sec
+                start = time_sec
+    job.result()
     
-    # Create segments, filtering very short ones
-    segments = []
-    for i in range(len(scene_times) - 1):
-        start = scene_times[i]
-        end = scene_times[i + 1]
-        if end - start >= 0.5:  # At least 0.5 seconds
-            segments.append((start, end))
+    if info.duration - start >= min_duration:
+        yield start, info.duration
+
+def detect_scenes_upper_half(video_path, threshold=0.02):
+    """
+    Scene detection with ffmpeg's select/showinfo filters on the upper half.
+    Returns (segments, (width, height)).
+    """
+    segments = list(stream_scenes_upper_half(video_path, threshold))
+    info = media_probe.probe(video_path)
+    return segments, (info.width, info.height)
+
+def detect_scenes_cached(video_path, detector, threshold, use_cache=True):
+    """
+    Run a detector, reusing a previous result for the same video content,
+    threshold, crop region and detector version.
+    Returns (segments, (width, height)).
+    """
+    if not use_cache:
+        return DETECTORS[detector](video_path, threshold, False)
+    
+    key = disk_cache.cache_key('scenes', DETECTOR_VERSION, detector,
+                               disk_cache.fast_file_hash(video_path),
+                               threshold, UPPER_HALF_CROP)
+    cached = disk_cache.load_json('scenes', key)
+    if cached is not None:
+        print("Scene detection: cache hit, skipping analysis")
+        segments = [tuple(seg) for seg in cached['segments']]
+        return segments, tuple(cached['dimensions'])
     
+    segments, (width, height) = DETECTORS[detector](video_path, threshold, True)
+    disk_cache.store_json('scenes', key, {
+        'segments': segments,
+        'dimensions': [width, height]
+    })
     return segments, (width, height)
 
 def extract_still_image(video_path, time_sec, output_path):
@@ -86,9 +121,38 @@ def extract_still_image(video_path, time_sec, output_path):
         '-q:v', '2',
         output_path
     ]
-    subprocess.run(cmd, capture_output=True)
+    ffmpeg_jobs.run(cmd)
     print(f"  Image: {output_path}")
 
+def extract_still_images(video_path, times, output_paths):
+    """
+    Extract one frame per timestamp in a single decoder run.
+    Each split branch is trimmed to start at its timestamp and keeps only its
+    first frame, matching `-ss t -vframes 1` on the output side.
+    """
+    if not times:
+        return
+    
+    n = len(times)
+    graph = [f"[0:v]split={n}" + ''.join(f"[v{i}]" for i in range(n))]
+    for i, time_sec in enumerate(times):
+        graph.append(f"[v{i}]trim=start={time_sec},setpts=PTS-STARTPTS[o{i}]")
+    
+    cmd = ['ffmpeg', '-y', '-i', video_path, '-filter_complex', ';'.join(graph)]
+    for i, output_path in enumerate(output_paths):
+        cmd += [
+            '-map', f'[o{i}]',
+            '-vframes', '1',
+            '-q:v', '2',
+            str(output_path)
+        ]
+    result = ffmpeg_jobs.run(cmd)
+    if result.returncode != 0:
+        raise RuntimeError(f"Extracting images of {video_path} failed: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+    for output_path in output_paths:
+        print(f"  Image: {output_path}")
+
 def extract_audio_segment(video_path, start_sec, end_sec, output_path):
     """Extract audio segment for given time range"""
     duration = end_sec - start_sec
@@ -102,51 +166,305 @@ def extract_audio_segment(video_path, start_sec, end_sec, output_path):
         '-ac', '2',  # Stereo
         output_path
     ]
-    subprocess.run(cmd, capture_output=True)
+    ffmpeg_jobs.run(cmd)
     print(f"  Audio: {output_path}")
 
+def extract_audio_segments(video_path, segments, output_paths):
+    """
+    Extract audio for all segments in a single pass over the input.
+    One asplit/atrim filter graph feeds one WAV output per segment, so the
+    source is decoded once instead of once per section.
+    """
+    if not segments:
+        return
+    
+    n = len(segments)
+    graph = [f"[0:a]asplit={n}" + ''.join(f"[a{i}]" for i in range(n))]
+    for i, (start, end) in enumerate(segments):
+        graph.append(f"[a{i}]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[o{i}]")
+    
+    cmd = ['ffmpeg', '-y', '-i', video_path, '-filter_complex', ';'.join(graph)]
+    for i, output_path in enumerate(output_paths):
+        cmd += [
+            '-map', f'[o{i}]',
+            '-acodec', 'pcm_s16le',  # PCM 16-bit
+            '-ar', '48000',  # 48kHz
+            '-ac', '2',  # Stereo
+            str(output_path)
+        ]
+    result = ffmpeg_jobs.run(cmd)
+    if result.returncode != 0:
+        # One run writes every section, so a failure loses them all
+        raise RuntimeError(f"Extracting audio of {video_path} failed: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+    for output_path in output_paths:
+        print(f"  Audio: {output_path}")
+
+def submit_section_extraction(video_path, start_sec, end_sec, img_path, audio_path):
+    """
+    Queue the still image and audio jobs of one section on the ffmpeg
+    orchestrator. Both seek on the input side, so each job only decodes its
+    own part of the video. Returns the two futures.
+    """
+    img_cmd = [
+        'ffmpeg', '-y', '-ss', str(start_sec + 0.3), '-i', video_path,
+        '-vframes', '1',
+        '-q:v', '2',
+        str(img_path)
+    ]
+    audio_cmd = [
+        'ffmpeg', '-y', '-ss', str(start_sec), '-i', video_path,
+        '-t', str(end_sec - start_sec),
+        '-vn',  # No video
+        '-acodec', 'pcm_s16le',  # PCM 16-bit
+        '-ar', '48000',  # 48kHz
+        '-ac', '2',  # Stereo
+        str(audio_path)
+    ]
+    return [ffmpeg_jobs.submit(img_cmd), ffmpeg_jobs.submit(audio_cmd)]
+
+def extract_streaming(video_path, output_dir, threshold):
+    """
+    Detect scenes and extract sections at the same time: each section is
+    queued for extraction as soon as the scene change ending it is reported.
+    Returns the segments once every extraction has finished.
+    """
+    segments = []
+    jobs = []
+    for start, end in stream_scenes_upper_half(video_path, threshold):
+        segments.append((start, end))
+        n = len(segments)
+        print(f"  Section {n}: {start:.2f}s - {end:.2f}s (duration: {end-start:.2f}s), extracting")
+        jobs += submit_section_extraction(video_path, start, end,
+                                          output_dir / f"section_{n:03d}.jpg",
+                                          output_dir / f"section_{n:03d}.wav")
+    for job in jobs:
+        job.result()
+    return segments
+
+def match_segments(old_segments, new_segments, tolerance=0.05):
+    """
+    Match intervals of two sorted segment lists whose start and end both
+    agree within tolerance seconds. Returns {new_index: old_index}.
+    """
+    matches = {}
+    i = j = 0
+    while i < len(old_segments) and j < len(new_segments):
+        old_start, old_end = old_segments[i]
+        new_start, new_end = new_segments[j]
+        if abs(old_start - new_start) <= tolerance and abs(old_end - new_end) <= tolerance:
+            matches[j] = i
+            i += 1
+            j += 1
+        elif old_start < new_start:
+            i += 1
+        else:
+            j += 1
+    return matches
+
+def move_artifacts(moves):
+    """
+    Rename (src, dst) pairs in two phases: every file is first moved to a
+    temporary name, then to its destination, so shifted section numbers
+    never overwrite a file that is still to be moved.
+    """
+    staged = []
+    for src, dst in moves:
+        if src == dst:
+            continue
+        tmp = dst.with_name(f".{dst.name}.reuse")
+        os.replace(src, tmp)
+        staged.append((tmp, dst))
+    for tmp, dst in staged:
+        os.replace(tmp, dst)
+
+def reuse_sections(segments, output_dir, mp3_dir, tolerance=0.05):
+    """
+    Keep the artifacts of previous sections whose interval is unchanged.
+    Their WAV and JPG (and the MP3 and JPG convert_to_mp3.py made from them)
+    are renamed to the new section numbers, and the MP3 summary is rewritten
+    for the kept sections so their trim ledger stays valid.
+    Returns {new_index: old_record}.
+    """
+    summary_path = output_dir / "sections_summary.json"
+    if not summary_path.exists():
+        return {}
+    old_sections = summary_io.load_summary(summary_path)
+    old_segments = [(s['start_time'], s['end_time']) for s in old_sections]
+    matches = {
+        j: old_sections[i] for j, i in match_segments(old_segments, segments, tolerance).items()
+        if (output_dir / old_sections[i]['audio']).exists() and
+        (output_dir / old_sections[i]['image']).exists()
+    }
+    
+    mp3_summary_path = mp3_dir / "sections_summary.json"
+    old_mp3 = {}
+    if mp3_summary_path.exists():
+        old_mp3 = {s['section']: s for s in summary_io.load_summary(mp3_summary_path)}
+    
+    moves = []
+    mp3_sections = []
+    for j, old in sorted(matches.items()):
+        name = f"section_{j+1:03d}"
+        moves.append((output_dir / old['audio'], output_dir / f"{name}.wav"))
+        moves.append((output_dir / old['image'], output_dir / f"{name}.jpg"))
+        mp3 = old_mp3.get(old['section'])
+        if mp3 is not None and (mp3_dir / mp3['audio']).exists():
+            moves.append((mp3_dir / mp3['audio'], mp3_dir / f"{name}.mp3"))
+            if (mp3_dir / mp3['image']).exists():
+                moves.append((mp3_dir / mp3['image'], mp3_dir / f"{name}.jpg"))
+            mp3_sections.append(dict(mp3, section=j + 1, audio=f"{name}.mp3", image=f"{name}.jpg"))
+    move_artifacts(moves)
+    if old_mp3:
+        # Sections that changed are left for convert_to_mp3.py to rebuild
+        summary_io.write_json_atomic(mp3_summary_path, mp3_sections)
+    
+    mapping = {
+        'tolerance': tolerance,
+        'mapping': [{'old': old['section'], 'new': j + 1} for j, old in sorted(matches.items())],
+        'new': [j + 1 for j in range(len(segments)) if j not in matches],
+        'dropped': sorted(set(s['section'] for s in old_sections) -
+                          set(old['section'] for old in matches.values()))
+    }
+    summary_io.write_json_atomic(output_dir / "section_mapping.json", mapping)
+    return matches
+
 def main():
-    video_path = "吴语上丽片-松阳话 [BV1icCyYAEr5].mp4"
-    output_dir = Path("output_sections")
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='?', default="吴语上丽片-松阳话 [BV1icCyYAEr5].mp4")
+    parser.add_argument('--output-dir', default="output_sections")
+    parser.add_argument('--threshold', default='0.02',
+                        help="scene change threshold (0.0-1.0), lower = more sensitive; "
+                             "'auto' calibrates it from the per-frame score distribution")
+    parser.add_argument('--detector', choices=sorted(DETECTORS), default='numpy',
+                        help="numpy: downscaled luma over a rawvideo pipe (default); "
+                             "keyframes: scan keyframes, refine changed GOPs only; "
+                             "bisect: 1 s seek samples, binary search to the frame; "
+                             "showinfo: full-resolution ffmpeg select filter")
+    parser.add_argument('--audio-mode', choices=['filter', 'memmap'], default='filter',
+                        help="filter: one ffmpeg filter graph writes every WAV (default); "
+                             "memmap: decode the audio once to a raw file and slice it")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="ignore and do not update the scene detection cache")
+    parser.add_argument('--stream', action='store_true',
+                        help="extract each section while showinfo detection is still "
+                             "running (implies --detector showinfo, no cache)")
+    parser.add_argument('--reuse', action='store_true',
+                        help="keep the WAV/JPG/MP3 of sections from the previous run whose "
+                             "interval is unchanged, extract only new ones, and write the "
+                             "old -> new numbering to section_mapping.json")
+    parser.add_argument('--reuse-tolerance', type=float, default=0.05,
+                        help="seconds a boundary may move and still count as unchanged")
+    parser.add_argument('--mp3-dir', default="output_sections_mp3",
+                        help="convert_to_mp3.py output whose MP3s --reuse renames too")
+    args = parser.parse_args()
+    if args.stream and args.audio_mode == 'memmap':
+        parser.error("--stream extracts each section's audio on its own; "
+                     "it can't be combined with --audio-mode memmap")
+    if args.stream and args.reuse:
+        parser.error("--stream extracts sections before all boundaries are known; "
+                     "it can't be combined with --reuse")
+    if args.threshold == 'auto' and (args.stream or args.detector == 'showinfo'):
+        # Calibration uses the downscaled luma scores; showinfo scores full-size YUV
+        parser.error("--threshold auto is calibrated for the numpy/keyframes/bisect "
+                     "detectors; give showinfo and --stream an explicit threshold")
+    
+    video_path = args.video
+    output_dir = Path(args.output_dir)
     output_dir.mkdir(exist_ok=True)
     
     print("=" * 60)
     print("Step 1: Detecting scene changes (upper half only)...")
     print("=" * 60)
     
-    # Detect scene changes with lower threshold (more sensitive)
-    segments, (width, height) = detect_scenes_upper_half(video_path, threshold=0.02)
+    threshold_margin = None
+    use_cache = not args.no_cache
+    if args.threshold == 'auto':
+        threshold, threshold_margin = auto_threshold(video_path, use_cache=use_cache)
+    else:
+        threshold = float(args.threshold)
     
-    print(f"\nFound {len(segments)} sections:")
-    for i, (start, end) in enumerate(segments):
-        print(f"  Section {i+1}: {start:.2f}s - {end:.2f}s (duration: {end-start:.2f}s)")
-    
-    print("\n" + "=" * 60)
-    print("Step 2: Extracting images and audio...")
-    print("=" * 60)
+    pcm_ranges = None
+    if args.stream:
+        # Detection and extraction overlap, so there is no separate step 2
+        segments = extract_streaming(video_path, output_dir, threshold)
+        print(f"\nFound {len(segments)} sections, all extracted")
+    else:
+        # Detect scene changes with lower threshold (more sensitive)
+        segments, (width, height) = detect_scenes_cached(video_path, args.detector, threshold, use_cache)
+        
+        print(f"\nFound {len(segments)} sections:")
+        for i, (start, end) in enumerate(segments):
+            print(f"  Section {i+1}: {start:.2f}s - {end:.2f}s (duration: {end-start:.2f}s)")
+        
+        print("\n" + "=" * 60)
+        print("Step 2: Extracting images and audio...")
+        print("=" * 60)
     
     results = []
+    audio_paths = [output_dir / f"section_{i+1:03d}.wav" for i in range(len(segments))]
+    img_paths = [output_dir / f"section_{i+1:03d}.jpg" for i in range(len(segments))]
     
-    for i, (start, end) in enumerate(segments):
-        section_num = i + 1
+    mapping_path = output_dir / "section_mapping.json"
+    if not args.reuse and mapping_path.exists():
+        # Numbering starts over, an old mapping no longer applies
+        mapping_path.unlink()
+    
+    if not args.stream:
+        reused = {}
+        if args.reuse:
+            reused = reuse_sections(segments, output_dir, Path(args.mp3_dir), args.reuse_tolerance)
+            print(f"\nReusing {len(reused)} unchanged sections, "
+                  f"extracting {len(segments) - len(reused)}")
+            # Kept files hold the previous interval, so the records say so
+            for j, old in reused.items():
+                segments[j] = (old['start_time'], old['end_time'])
+        todo = [i for i in range(len(segments)) if i not in reused]
         
         # Extract still image from middle of segment
-        img_time = start + 0.3
-        img_path = output_dir / f"section_{section_num:03d}.jpg"
-        audio_path = output_dir / f"section_{section_num:03d}.wav"
+        img_times = [segments[i][0] + 0.3 for i in todo]
+        
+        # All images and all section WAVs each come from one decode of the source
+        print("\nExtracting images for all sections in one pass...")
+        extract_still_images(video_path, img_times, [img_paths[i] for i in todo])
+        if args.audio_mode == 'memmap':
+            # Later stages read the same raw file for their silence analysis
+            print(f"\nDecoding audio once to {pcm_buffer.PCM_NAME}...")
+            pcm = pcm_buffer.decode_audio(video_path, output_dir / pcm_buffer.PCM_NAME)
+            pcm_buffer.write_sections(pcm, [segments[i] for i in todo],
+                                      [audio_paths[i] for i in todo])
+            pcm_ranges = []
+            for start, end in segments:
+                first, last = pcm_buffer.sample_range(start, end)
+                pcm_ranges.append((first, min(last, len(pcm))))
+        else:
+            print("\nExtracting audio for all sections in one pass...")
+            extract_audio_segments(video_path, [segments[i] for i in todo],
+                                   [audio_paths[i] for i in todo])
+    
+    for i, (start, end) in enumerate(segments):
+        section_num = i + 1
+        img_path = img_paths[i]
+        audio_path = audio_paths[i]
         
-        print(f"\nSection {section_num} ({start:.1f}s - {end:.1f}s):")
-        extract_still_image(video_path, img_time, str(img_path))
-        extract_audio_segment(video_path, start, end, str(audio_path))
+        print(f"\nSection {section_num} ({start:.1f}s - {end:.1f}s): {img_path.name}, {audio_path.name}")
         
-        results.append({
+        record = {
             'section': section_num,
             'start_time': start,
             'end_time': end,
             'duration': end - start,
             'image': str(img_path.name),
-            'audio': str(audio_path.name)
-        })
+            'audio': str(audio_path.name),
+            'scene_threshold': threshold
+        }
+        if threshold_margin is not None:
+            record['scene_threshold_margin'] = threshold_margin
+        if pcm_ranges is not None:
+            record['pcm'] = pcm_buffer.PCM_NAME
+            record['pcm_start'], record['pcm_end'] = pcm_ranges[i]
+        results.append(record)
     
     # Write summary JSON
     summary_path = output_dir / "sections_summary.json"
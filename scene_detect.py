@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+In-process scene detection for videos composed of still images.
+
+Instead of running ffmpeg's select/showinfo filters on the full-resolution
+frame and scraping stderr, ffmpeg only decodes, crops the upper half and
+downscales it to a small grayscale image. The frames arrive over a rawvideo
+pipe and the scene scores are computed with NumPy.
+"""
+
+import argparse
+import numpy as np
+
+import ffmpeg_jobs
+from disk_cache import fast_file_hash, cache_key, cache_path, touch, lru_evict
+import media_probe
+
+SCAN_WIDTH = 64  # Slides are static, a thumbnail-sized luma image is plenty
+CHUNK_FRAMES = 256  # Frames read from the pipe per vectorized step
+MIN_SEGMENT = 0.5  # Drop sections shorter than this (seconds)
+MIN_CALIBRATION_SCORE = 1e-3  # Scores below this are treated as static frames
+MIN_CALIBRATION_MARGIN = 3.0  # Smallest ratio across the gap that counts as a split
+SCORE_VERSION = 1  # Bump when the score computation changes
+DETECTOR_VERSION = 1  # Bump when any detector's segment output changes
+UPPER_HALF_CROP = "crop=iw:ih/2:0:0"  # Region all detectors look at
+
+def probe_video(video_path):
+    """Return (width, height, duration) of the first video stream"""
+    info = media_probe.probe(video_path)
+    return info.width, info.height, info.duration
+
+def get_frame_index(video_path):
+    """
+    Presentation timestamps of every video frame in display order, plus a
+    boolean keyframe mask. Read from the packet headers, so nothing is decoded.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        video_path
+    ]
+    result = ffmpeg_jobs.run(cmd, text=True)
+    times = []
+    keys = []
+    for line in result.stdout.split():
+        parts = line.split(',')
+        if not parts[0] or parts[0] == 'N/A':
+            continue
+        times.append(float(parts[0]))
+        keys.append(len(parts) > 1 and 'K' in parts[1])
+    times = np.array(times, dtype=np.float64)
+    order = np.argsort(times, kind='stable')
+    return times[order], np.array(keys, dtype=bool)[order]
+
+def scan_size(width, height, scan_width=SCAN_WIDTH):
+    """Size of the downscaled upper-half image, height rounded to even"""
+    scan_height = max(2, int(round(scan_width * (height // 2) / width / 2)) * 2)
+    return scan_width, scan_height
+
+def gray_scan_filter(width, height, scan_width=SCAN_WIDTH):
+    """Crop to the upper half, downscale and convert to 8-bit luma"""
+    sw, sh = scan_size(width, height, scan_width)
+    return f"crop={width}:{height//2}:0:0,scale={sw}:{sh}:flags=area,format=gray"
+
+def read_frame_diffs(proc, frame_shape):
+    """
+    Read grayscale frames from an ffmpeg rawvideo pipe and return the mean
+    absolute frame difference (MAFD) of each frame against the previous one.
+    Frames are read into a preallocated buffer whose first row carries the
+    previous chunk's last frame, so every chunk is diffed in one step.
+    """
+    sh, sw = frame_shape
+    frame_bytes = sh * sw
+    buf = np.empty((CHUNK_FRAMES + 1, sh, sw), dtype=np.uint8)
+    work = np.empty((CHUNK_FRAMES, sh, sw), dtype=np.int16)
+    view = memoryview(buf).cast('B')
+
+    diffs = []
+    have_prev = False
+    while True:
+        # Fill rows 1..CHUNK_FRAMES (row 0 is the previous frame)
+        offset = frame_bytes
+        while offset < len(view):
+            n = proc.stdout.readinto(view[offset:])
+            if not n:
+                break
+            offset += n
+        n_frames = offset // frame_bytes - 1
+        if n_frames <= 0:
+            break
+
+        if not have_prev:
+            # First frame has nothing to compare against
+            buf[0] = buf[1]
+            have_prev = True
+
+        w = work[:n_frames]
+        np.subtract(buf[1:n_frames + 1], buf[:n_frames], out=w, dtype=np.int16)
+        np.abs(w, out=w)
+        diffs.append(w.reshape(n_frames, -1).sum(axis=1, dtype=np.int64) / frame_bytes)
+
+        buf[0] = buf[n_frames]
+        if offset < len(view):
+            break
+
+    if not diffs:
+        return np.zeros(0)
+    return np.concatenate(diffs)
+
+def scene_scores_from_mafd(mafd):
+    """
+    Same formula as ffmpeg's select `scene` variable:
+    min(mafd, |mafd - prev_mafd|) / 100, clipped to [0, 1].
+    """
+    prev = np.concatenate(([0.0], mafd[:-1]))
+    return np.clip(np.minimum(mafd, np.abs(mafd - prev)) / 100.0, 0.0, 1.0)
+
+def compute_scene_scores(video_path, width, height, scan_width=SCAN_WIDTH):
+    """
+    Decode the whole video once and return (times, scores), one entry per frame.
+    """
+    sw, sh = scan_size(width, height, scan_width)
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', video_path,
+        '-an',
+        '-vf', gray_scan_filter(width, height, scan_width),
+        '-vsync', '0',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-'
+    ]
+    mafd = scan_frames(cmd, (sh, sw))
+    scores = scene_scores_from_mafd(mafd)
+    times, _ = get_frame_index(video_path)
+    n = min(len(times), len(scores))
+    return times[:n], scores[:n]
+
+def load_scene_scores(video_path, width, height, scan_width=SCAN_WIDTH, use_cache=True):
+    """
+    Per-frame (times, scores), read from the .npz sidecar in the cache when
+    present. The key covers the video content, crop region and scan size,
+    so any threshold can be re-applied without decoding again.
+    """
+    key = cache_key('scores', SCORE_VERSION, fast_file_hash(video_path),
+                    gray_scan_filter(width, height, scan_width))
+    path = cache_path('scores', key, '.npz')
+    if use_cache and path.exists():
+        touch(path)
+        with np.load(path) as data:
+            return data['times'], data['scores']
+
+    times, scores = compute_scene_scores(video_path, width, height, scan_width)
+    if use_cache:
+        tmp = path.with_suffix('.tmp.npz')
+        np.savez(tmp, times=times, scores=scores)
+        tmp.replace(path)
+        lru_evict()
+    return times, scores
+
+def scan_frames(cmd, frame_shape):
+    """Run an ffmpeg rawvideo command and return the MAFD of each output frame"""
+    with ffmpeg_jobs.popen(cmd) as proc:
+        return read_frame_diffs(proc, frame_shape)
+
+def decode_gop_window(video_path, width, height, key_time, n_frames, scan_width=SCAN_WIDTH):
+    """
+    Decode n_frames starting at the keyframe at key_time and return their MAFD.
+    The seek lands on the keyframe itself, so only this window is decoded.
+    """
+    sw, sh = scan_size(width, height, scan_width)
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-seek_timestamp', '1', '-noaccurate_seek',
+        '-ss', f"{key_time + 0.0005:.6f}",
+        '-i', video_path,
+        '-an',
+        '-vf', gray_scan_filter(width, height, scan_width),
+        '-vsync', '0',
+        '-frames:v', str(n_frames),
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-'
+    ]
+    return scan_frames(cmd, (sh, sw))
+
+def detect_scenes_keyframes(video_path, threshold=0.02, scan_width=SCAN_WIDTH,
+                            candidate_factor=0.5, stats=None):
+    """
+    Keyframe-only scan for slideshow videos.
+    1. Decode only keyframes (-skip_frame nokey) and compare neighbours.
+    2. For every pair that differs by more than candidate_factor * threshold,
+       decode just that GOP and locate the change with the full-decode scores.
+    The last GOP is always refined since there is no keyframe after it.
+    A change that is reverted within a single GOP is not seen.
+    Returns (segments, (width, height)); frames decoded are put in stats.
+    """
+    print("Analyzing video for scene changes (upper half, keyframe scan)...")
+    width, height, duration = probe_video(video_path)
+    sw, sh = scan_size(width, height, scan_width)
+    print(f"Video dimensions: {width}x{height}")
+    
+    times, is_key = get_frame_index(video_path)
+    key_idx = np.flatnonzero(is_key)
+    
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-skip_frame', 'nokey',
+        '-i', video_path,
+        '-an',
+        '-vf', gray_scan_filter(width, height, scan_width),
+        '-vsync', '0',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-'
+    ]
+    key_mafd = scan_frames(cmd, (sh, sw))
+    frames_decoded = len(key_mafd)
+    n_keys = min(len(key_mafd), len(key_idx))
+    
+    # GOPs to refine: (first frame index, last frame index) inclusive
+    windows = []
+    for k in range(1, n_keys):
+        if key_mafd[k] / 100.0 > threshold * candidate_factor:
+            windows.append((key_idx[k - 1], key_idx[k]))
+    if n_keys:
+        windows.append((key_idx[n_keys - 1], len(times) - 1))
+    
+    scene_times = []
+    for first, last in windows:
+        n_frames = last - first + 1
+        if n_frames < 2:
+            continue
+        mafd = decode_gop_window(video_path, width, height, times[first], n_frames, scan_width)
+        frames_decoded += len(mafd)
+        scores = scene_scores_from_mafd(mafd)
+        window_times = times[first:first + len(scores)]
+        scene_times.extend(float(t) for t in window_times[1:][scores[1:] > threshold])
+    
+    print(f"Keyframes scanned: {n_keys}, GOPs refined: {len(windows)}")
+    print(f"Frames decoded: {frames_decoded} of {len(times)}")
+    if stats is not None:
+        stats['frames_decoded'] = frames_decoded
+        stats['frames_total'] = len(times)
+    
+    segments = segments_from_scene_times(sorted(set(scene_times)), duration)
+    return segments, (width, height)
+
+def grab_frame(video_path, width, height, time_sec, scan_width=SCAN_WIDTH):
+    """
+    Fast input seek to time_sec and return the first frame at or after it as
+    a downscaled grayscale array, or None past the end of the stream.
+    """
+    sw, sh = scan_size(width, height, scan_width)
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-seek_timestamp', '1',
+        '-ss', f"{time_sec:.6f}",
+        '-i', video_path,
+        '-an',
+        '-vf', gray_scan_filter(width, height, scan_width),
+        '-frames:v', '1',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-'
+    ]
+    result = ffmpeg_jobs.run(cmd)
+    if len(result.stdout) < sw * sh:
+        return None
+    return np.frombuffer(result.stdout[:sw * sh], dtype=np.uint8).reshape(sh, sw)
+
+def detect_scenes_bisect(video_path, threshold=0.02, interval=1.0, scan_width=SCAN_WIDTH,
+                         stats=None):
+    """
+    Coarse-to-fine scene detection.
+    Sample one frame every `interval` seconds with fast input seeking, then
+    binary-search every pair of differing samples down to the exact frame.
+    Decode cost grows with the number of slide changes, not the frame count.
+    Returns (segments, (width, height)); seeks made are put in stats.
+    """
+    print("Analyzing video for scene changes (upper half, coarse-to-fine)...")
+    width, height, duration = probe_video(video_path)
+    print(f"Video dimensions: {width}x{height}")
+    
+    times, _ = get_frame_index(video_path)
+    if len(times) == 0:
+        return segments_from_scene_times([], duration), (width, height)
+    
+    frames = {}
+    
+    def frame_at(idx):
+        # Seek halfway between the previous frame and this one, so rounding
+        # in the printed timestamps can never select the wrong frame
+        if idx not in frames:
+            seek = times[0] if idx == 0 else (times[idx - 1] + times[idx]) / 2
+            frames[idx] = grab_frame(video_path, width, height, seek, scan_width)
+        return frames[idx]
+    
+    def differs(a, b):
+        fa, fb = frame_at(a), frame_at(b)
+        if fa is None or fb is None:
+            return False
+        mafd = np.abs(fa.astype(np.int16) - fb).mean()
+        return mafd / 100.0 > threshold
+    
+    def bisect(a, b):
+        # Changes in (a, b], given that frames a and b differ
+        if b - a <= 1:
+            return [b]
+        m = (a + b) // 2
+        found = []
+        if differs(a, m):
+            found += bisect(a, m)
+        if differs(m, b):
+            found += bisect(m, b)
+        return found
+    
+    sample_idx = np.unique(np.concatenate((
+        np.searchsorted(times, np.arange(times[0], times[-1], interval)),
+        [len(times) - 1]
+    )))
+    
+    change_idx = []
+    for a, b in zip(sample_idx[:-1], sample_idx[1:]):
+        if differs(a, b):
+            change_idx += bisect(int(a), int(b))
+    
+    seeks = len(frames)
+    print(f"Samples: {len(sample_idx)}, changes found: {len(change_idx)}, seeks: {seeks}")
+    if stats is not None:
+        stats['seeks'] = seeks
+    
+    scene_times = [float(times[i]) for i in sorted(set(change_idx))]
+    segments = segments_from_scene_times(scene_times, duration)
+    return segments, (width, height)
+
+def segments_from_scene_times(scene_times, duration, min_duration=MIN_SEGMENT):
+    """Turn scene change times into (start, end) segments, filtering short ones"""
+    scene_times = [0.0] + list(scene_times) + [duration]
+    segments = []
+    for i in range(len(scene_times) - 1):
+        start = scene_times[i]
+        end = scene_times[i + 1]
+        if end - start >= min_duration:
+            segments.append((start, end))
+    return segments
+
+def segments_from_scores(times, scores, threshold, duration, min_duration=MIN_SEGMENT):
+    """Apply a scene threshold (ffmpeg `gt(scene,threshold)`) to a score series"""
+    scene_times = [float(t) for t in times[scores > threshold]]
+    return segments_from_scene_times(scene_times, duration, min_duration)
+
+def calibrate_threshold(scores, min_score=MIN_CALIBRATION_SCORE, default=0.02,
+                        min_margin=MIN_CALIBRATION_MARGIN):
+    """
+    Pick a scene threshold from the score distribution.
+    Still slides give a noise floor of tiny scores (most frames, so it holds
+    the median) and a few large ones at the slide changes. The threshold is
+    put at the geometric middle of the first gap above the median whose
+    ratio is at least min_margin, so slide changes of different sizes
+    (a text edit on the same template vs. a new slide) all stay above it.
+    Scores below min_score count as min_score.
+    Returns (threshold, margin) where margin is the ratio across the gap,
+    or (default, widest ratio seen) if no gap is wide enough.
+    """
+    if len(scores) == 0:
+        return default, 0.0
+    clipped = np.maximum(scores, min_score)
+    values = np.unique(clipped[clipped >= np.median(clipped)])
+    if len(values) < 2:
+        return default, 0.0
+    ratios = values[1:] / values[:-1]
+    wide = np.flatnonzero(ratios >= min_margin)
+    if len(wide) == 0:
+        return default, float(ratios.max())
+    i = int(wide[0])
+    threshold = float(np.sqrt(values[i] * values[i + 1]))
+    return threshold, float(ratios[i])
+
+def auto_threshold(video_path, scan_width=SCAN_WIDTH, use_cache=True):
+    """Calibrate the threshold for a video from its (cached) per-frame scores"""
+    width, height, _ = probe_video(video_path)
+    _, scores = load_scene_scores(video_path, width, height, scan_width, use_cache)
+    threshold, margin = calibrate_threshold(scores)
+    if margin < MIN_CALIBRATION_MARGIN:
+        print(f"Warning: no clear gap between noise and scene changes (margin x{margin:.1f}), "
+              f"using the default threshold {threshold:.4f}")
+    else:
+        print(f"Calibrated scene threshold: {threshold:.4f} (margin x{margin:.1f})")
+    return threshold, margin
+
+def detect_scenes_numpy(video_path, threshold=0.02, scan_width=SCAN_WIDTH, use_cache=True):
+    """
+    Drop-in replacement for detect_scenes_upper_half().
+    Per-frame scores are cached, so a new threshold costs no decode.
+    Returns (segments, (width, height)).
+    """
+    print("Analyzing video for scene changes (upper half, NumPy backend)...")
+    width, height, duration = probe_video(video_path)
+    sw, sh = scan_size(width, height, scan_width)
+    print(f"Video dimensions: {width}x{height}")
+    print(f"Analyzing upper half: {width}x{height//2} (scaled to {sw}x{sh})")
+
+    times, scores = load_scene_scores(video_path, width, height, scan_width, use_cache)
+    print(f"Frames analyzed: {len(scores)}")
+
+    segments = segments_from_scores(times, scores, threshold, duration)
+    return segments, (width, height)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sweep scene thresholds over cached per-frame scores")
+    parser.add_argument('video')
+    parser.add_argument('--sweep', type=float, nargs='+',
+                        default=[0.005, 0.01, 0.02, 0.03, 0.05, 0.1])
+    parser.add_argument('--min-duration', type=float, default=MIN_SEGMENT)
+    args = parser.parse_args()
+
+    width, height, duration = probe_video(args.video)
+    times, scores = load_scene_scores(args.video, width, height)
+    threshold, margin = calibrate_threshold(scores)
+    print(f"Calibrated threshold: {threshold:.4f} (margin x{margin:.1f})")
+
+    print(f"{'threshold':>10}  {'sections':>8}")
+    for threshold in args.sweep:
+        segments = segments_from_scores(times, scores, threshold, duration, args.min_duration)
+        print(f"{threshold:>10.4f}  {len(segments):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+In-process silence detection with NumPy.
+
+Reads 16-bit PCM (directly from WAV files, or through an ffmpeg pipe for
+anything else), computes a per-frame level in dBFS and finds silent runs
+the way ffmpeg's silencedetect does: a run counts once it is at least
+min_duration long, and a run that reaches the end of the file has no end.
+"""
+
+import wave
+import argparse
+from pathlib import Path
+import numpy as np
+
+import ffmpeg_jobs
+import media_probe
+
+FRAME_SECONDS = 0.01  # Analysis frame (10 ms)
+NOISE_FLOOR_PERCENTILE = 10  # Quietest frames taken as the recording's floor
+NOISE_OFFSET_DB = 15  # Silence threshold sits this far above the floor
+NOISE_DB_RANGE = (-60, -30)  # Derived thresholds are clamped to this range
+
+def read_pcm(path):
+    """
+    Return (samples, sample_rate) with samples as an int16 array of shape
+    (n_samples, channels). 16-bit WAVs are read directly; other files are
+    decoded by ffmpeg at their native rate and channel count.
+    """
+    try:
+        with wave.open(str(path), 'rb') as w:
+            if w.getsampwidth() == 2:
+                channels = w.getnchannels()
+                data = w.readframes(w.getnframes())
+                samples = np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+                return samples, w.getframerate()
+    except (wave.Error, EOFError):
+        pass
+
+    info = media_probe.probe(path)
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', str(path),
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-'
+    ]
+    result = ffmpeg_jobs.run(cmd)
+    channels = info.channels or 1
+    samples = np.frombuffer(result.stdout, dtype='<i2')
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels)
+    return samples, info.sample_rate
+
+def _frame_amplitudes(frames, measure):
+    """Amplitude (0..32768) of each row of a 2-D int16 frame array"""
+    if measure == 'rms':
+        x = frames.astype(np.float32)
+        return np.sqrt(np.einsum('ij,ij->i', x, x) / frames.shape[1])
+    return np.maximum(frames.max(axis=1).astype(np.int32),
+                      -frames.min(axis=1).astype(np.int32)).astype(np.float32)
+
+def frame_levels(samples, sample_rate, frame_seconds=FRAME_SECONDS, measure='peak'):
+    """
+    Level of each analysis frame in dBFS, taken across all channels.
+    measure='peak' matches silencedetect, which tests every sample against
+    the noise level; measure='rms' gives the frame energy instead.
+    The last partial frame is analyzed on its own samples.
+    """
+    if len(samples) == 0:
+        return np.zeros(0, dtype=np.float32)
+    frame_len = max(1, int(round(sample_rate * frame_seconds)))
+    flat = samples.reshape(len(samples), -1)
+    n_full = len(flat) // frame_len
+
+    # Whole frames are a reshaped view of the samples, no copy
+    level = _frame_amplitudes(flat[:n_full * frame_len].reshape(n_full, -1), measure)
+    if len(flat) > n_full * frame_len:
+        tail = flat[n_full * frame_len:].reshape(1, -1)
+        level = np.concatenate((level, _frame_amplitudes(tail, measure)))
+    return 20 * np.log10(np.maximum(level, 1.0) / 32768.0)
+
+def quiet_runs(levels_db, noise_db):
+    """(starts, ends) frame indices of runs of frames below noise_db"""
+    quiet = np.concatenate(([0], (levels_db < noise_db).astype(np.int8), [0]))
+    edges = np.diff(quiet)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def runs_to_silences(starts, ends, n_frames, min_duration, frame_seconds=FRAME_SECONDS):
+    """Keep runs at least min_duration long and convert them to seconds"""
+    min_frames = min_duration / frame_seconds - 1e-9
+
+    silences = []
+    for start, end in zip(starts, ends):
+        if end - start < min_frames:
+            continue
+        end_time = None if end == n_frames else float(end * frame_seconds)
+        silences.append((float(start * frame_seconds), end_time))
+    return silences
+
+def silence_intervals(levels_db, noise_db=-40, min_duration=0.3, frame_seconds=FRAME_SECONDS):
+    """
+    Silent runs as (start, end) tuples in seconds; end is None when the
+    silence runs to the end of the file (silencedetect prints no end then).
+    """
+    starts, ends = quiet_runs(levels_db, noise_db)
+    return runs_to_silences(starts, ends, len(levels_db), min_duration, frame_seconds)
+
+def sweep_silences(levels_db, noise_dbs, min_durations, frame_seconds=FRAME_SECONDS):
+    """
+    Silence intervals for a whole grid of settings from one level envelope.
+    Runs are found once per noise level; each min_duration only filters them.
+    Returns {(noise_db, min_duration): silences}.
+    """
+    results = {}
+    for noise_db in noise_dbs:
+        starts, ends = quiet_runs(levels_db, noise_db)
+        for min_duration in min_durations:
+            results[(noise_db, min_duration)] = runs_to_silences(
+                starts, ends, len(levels_db), min_duration, frame_seconds)
+    return results
+
+def sweep_trims(paths, noise_dbs, min_durations, policy, frame_seconds=FRAME_SECONDS):
+    """
+    Total seconds trimmed across files for every (noise_db, min_duration).
+    Each file is decoded and analyzed once. policy(silences, duration)
+    returns (trim_start, trim_end) the way one of the scripts would trim.
+    """
+    totals = {(n, d): 0.0 for n in noise_dbs for d in min_durations}
+    total_duration = 0.0
+    for path in paths:
+        samples, sample_rate = read_pcm(path)
+        duration = len(samples) / sample_rate
+        total_duration += duration
+        levels = frame_levels(samples, sample_rate, frame_seconds)
+        for setting, silences in sweep_silences(levels, noise_dbs, min_durations,
+                                                frame_seconds).items():
+            trim_start, trim_end = policy(silences, duration)
+            totals[setting] += trim_start + trim_end
+    return totals, total_duration
+
+def detect_silences(path, noise_db=-40, min_duration=0.3, frame_seconds=FRAME_SECONDS,
+                    samples=None, sample_rate=None):
+    """
+    Silence intervals of an audio file (see silence_intervals).
+    Already loaded samples (e.g. a slice of the shared PCM map) can be
+    passed instead of reading path.
+    """
+    if samples is None:
+        samples, sample_rate = read_pcm(path)
+    levels = frame_levels(samples, sample_rate, frame_seconds)
+    return silence_intervals(levels, noise_db, min_duration, frame_seconds)
+
+def estimate_noise_floor(levels_db, percentile=NOISE_FLOOR_PERCENTILE):
+    """
+    Noise floor of a recording in dBFS: a low percentile of the frame levels.
+    Speech pauses make up a good share of every section, so the quietest
+    frames are the room/preamp noise at whatever gain it was recorded.
+    """
+    if len(levels_db) == 0:
+        return NOISE_DB_RANGE[0] - NOISE_OFFSET_DB
+    return float(np.percentile(levels_db, percentile))
+
+def threshold_from_floor(noise_floor_db, offset_db=NOISE_OFFSET_DB):
+    """Silence threshold relative to the noise floor, clamped to NOISE_DB_RANGE"""
+    lo, hi = NOISE_DB_RANGE
+    return float(min(hi, max(lo, noise_floor_db + offset_db)))
+
+def detect_silences_auto(path, min_duration=0.3, offset_db=NOISE_OFFSET_DB,
+                         frame_seconds=FRAME_SECONDS, samples=None, sample_rate=None):
+    """
+    Estimate the file's noise floor and detect silence relative to it, from
+    the same level envelope.
+    Returns (silences, noise_floor_db, noise_db).
+    """
+    if samples is None:
+        samples, sample_rate = read_pcm(path)
+    levels = frame_levels(samples, sample_rate, frame_seconds)
+    noise_floor_db = estimate_noise_floor(levels)
+    noise_db = threshold_from_floor(noise_floor_db, offset_db)
+    silences = silence_intervals(levels, noise_db, min_duration, frame_seconds)
+    return silences, noise_floor_db, noise_db
+
+def convert_policy(silences, duration):
+    """Trim plan of convert_to_mp3.py (30% cap, keep at least 0.5s)"""
+    import convert_to_mp3
+    silence_starts = [start for start, _ in silences]
+    silence_ends = [end for _, end in silences if end is not None]
+    return convert_to_mp3.plan_trim(silence_starts, silence_ends, duration)
+
+def trim_policy(silences, duration):
+    """Trim plan of trim_silence_inplace.py (40% cap, skip cuts under 0.1s)"""
+    import trim_silence_inplace
+    return trim_silence_inplace.plan_trim(silences, duration)
+
+POLICIES = {
+    'convert': convert_policy,
+    'trim': trim_policy,
+}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sweep silence settings over a directory of sections, "
+                    "decoding each file once")
+    parser.add_argument('directory', nargs='?', default="output_sections")
+    parser.add_argument('--noise-db', type=float, nargs='+', default=[-50, -45, -40, -35, -30])
+    parser.add_argument('--min-duration', type=float, nargs='+', default=[0.1, 0.2, 0.3, 0.5])
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='convert',
+                        help="trim rules to apply: convert_to_mp3.py or trim_silence_inplace.py")
+    args = parser.parse_args()
+
+    directory = Path(args.directory)
+    paths = sorted(directory.glob('section_*.wav')) or sorted(directory.glob('section_*.mp3'))
+    print(f"Analyzing {len(paths)} files in {directory}...")
+
+    totals, total_duration = sweep_trims(paths, args.noise_db, args.min_duration,
+                                         POLICIES[args.policy])
+
+    print(f"\nTotal audio: {total_duration:.1f}s, seconds trimmed per setting:")
+    print(f"{'noise_db':>9} " + ''.join(f"{f'd={d:g}':>9}" for d in args.min_duration))
+    for noise_db in args.noise_db:
+        row = ''.join(f"{totals[(noise_db, d)]:>9.1f}" for d in args.min_duration)
+        print(f"{noise_db:>9g} {row}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+The three pipeline scripts chained in memory: video -> trimmed MP3 sections.
+
+Runs the same stages as process_video.py, convert_to_mp3.py and
+trim_silence_inplace.py, with the same rules and the same intermediate MP3
+encode, but nothing between the stages touches the disk: section audio is
+sliced from the decoded track, the convert stage's MP3 comes back from
+ffmpeg's stdout, and the trim stage decodes it through a pipe. Only the
+final JPGs and MP3s and one summary are written.
+
+Unlike fused_pipeline.py, which plans both trims on the source PCM and
+encodes once, this keeps the intermediate encode, so the trim stage
+analyzes the same audio it would have read back from disk.
+"""
+
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import convert_to_mp3
+import pcm_buffer
+import summary_io
+import trim_silence_inplace
+from process_video import detect_scenes_cached, extract_still_images, DETECTORS
+
+def load_source_audio(video_path, pcm_path=None):
+    """
+    Decoded audio track as an (n, channels) array: in memory, or memory
+    mapped from a raw file at pcm_path (e.g. on a tmpfs) for long videos.
+    """
+    if pcm_path is None:
+        return pcm_buffer.decode_audio_array(video_path)
+    return pcm_buffer.decode_audio(video_path, pcm_path)
+
+def convert_stage(samples, noise_db=-40, sample_rate=pcm_buffer.PCM_RATE):
+    """
+    convert_to_mp3.py on one section's samples.
+    Returns (mp3_bytes, n_samples, start_trim, end_trim, duration).
+    """
+    duration = len(samples) / sample_rate
+    silence_starts, silence_ends = convert_to_mp3.detect_silence(None, noise_db, samples=samples)
+    start_trim, end_trim = convert_to_mp3.plan_trim(silence_starts, silence_ends, duration)
+    first, last = pcm_buffer.sample_range(start_trim, duration - end_trim, sample_rate)
+    kept = samples[first:last]
+    return pcm_buffer.encode_mp3_bytes(kept, sample_rate), len(kept), start_trim, end_trim, duration
+
+def trim_stage(mp3_bytes, n_samples, noise_db=-40, sample_rate=pcm_buffer.PCM_RATE):
+    """
+    trim_silence_inplace.py on an in-memory MP3.
+    Returns (samples to encode, trim_start, trim_end).
+    """
+    samples = pcm_buffer.decode_mp3_bytes(mp3_bytes, n_samples, sample_rate)
+    duration = len(samples) / sample_rate
+    silences = trim_silence_inplace.detect_silence_full(None, noise_db, samples=samples)
+    trim_start, trim_end = trim_silence_inplace.plan_trim(silences, duration)
+    if not (trim_start or trim_end):
+        return samples, 0, 0
+    first, last = pcm_buffer.sample_range(trim_start, duration - trim_end, sample_rate)
+    return samples[first:last], trim_start, trim_end
+
+def chain_section(samples, mp3_path, noise_db=-40, sample_rate=pcm_buffer.PCM_RATE):
+    """
+    Both stages for one section, writing only the final MP3.
+    Returns (trim_start, trim_end, original_duration, new_duration).
+    """
+    mp3_bytes, n_samples, start_trim, end_trim, duration = convert_stage(samples, noise_db,
+                                                                         sample_rate)
+    final, trim_start, trim_end = trim_stage(mp3_bytes, n_samples, noise_db, sample_rate)
+    if pcm_buffer.encode_mp3(final, mp3_path, sample_rate) != 0:
+        raise RuntimeError(f"Encoding {mp3_path} failed")
+    return start_trim + trim_start, end_trim + trim_end, duration, len(final) / sample_rate
+
+def run_chain(video_path, output_dir, threshold=0.02, detector='numpy', noise_db=-40,
+              scratch_dir=None, jobs=1, use_cache=True):
+    """Run all stages for one video and return the section records"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True)
+
+    segments, _ = detect_scenes_cached(video_path, detector, threshold, use_cache)
+    print(f"Found {len(segments)} sections")
+
+    img_paths = [output_dir / f"section_{i+1:03d}.jpg" for i in range(len(segments))]
+    extract_still_images(video_path, [start + 0.3 for start, _ in segments], img_paths)
+
+    print("\nDecoding audio...")
+    pcm_path = None
+    if scratch_dir is not None:
+        pcm_path = Path(scratch_dir) / f"{Path(video_path).stem}.{pcm_buffer.PCM_NAME}"
+    pcm = load_source_audio(video_path, pcm_path)
+
+    def run(i):
+        start, end = segments[i]
+        first, last = pcm_buffer.sample_range(start, end)
+        mp3_path = output_dir / f"section_{i+1:03d}.mp3"
+        return chain_section(pcm[first:last], mp3_path, noise_db)
+
+    sections = [None] * len(segments)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(run, i): i for i in range(len(segments))}
+        for future in as_completed(futures):
+            i = futures[future]
+            start, end = segments[i]
+            trim_start, trim_end, duration, new_duration = future.result()
+            print(f"\nSection {i+1} ({start:.1f}s - {end:.1f}s):")
+            print(f"  Trimmed: start={trim_start:.2f}s, end={trim_end:.2f}s")
+            print(f"  Duration: {duration:.2f}s -> {new_duration:.2f}s")
+            sections[i] = {
+                'section': i + 1,
+                'start_time': start,
+                'end_time': end,
+                'duration': new_duration,
+                'image': img_paths[i].name,
+                'audio': f"section_{i+1:03d}.mp3",
+                'trim_start': trim_start,
+                'trim_end': trim_end,
+                'original_duration': duration,
+                'scene_threshold': threshold
+            }
+
+    del pcm
+    if pcm_path is not None:
+        pcm_path.unlink()
+
+    summary_io.write_json_atomic(output_dir / "sections_summary.json", sections)
+    return sections
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='?', default="吴语上丽片-松阳话 [BV1icCyYAEr5].mp4")
+    parser.add_argument('--output-dir', default="output_sections_mp3")
+    parser.add_argument('--threshold', type=float, default=0.02)
+    parser.add_argument('--detector', choices=sorted(DETECTORS), default='numpy')
+    parser.add_argument('--noise-db', type=float, default=-40)
+    parser.add_argument('--scratch-dir',
+                        help="memory-map the decoded audio from a raw file here "
+                             "(e.g. /dev/shm) instead of holding it in memory")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="sections to process concurrently")
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Chained pipeline: detect, convert and trim without intermediate files")
+    print("=" * 60)
+
+    sections = run_chain(args.video, args.output_dir, args.threshold, args.detector,
+                         args.noise_db, args.scratch_dir, args.jobs, not args.no_cache)
+
+    total_original = sum(s['original_duration'] for s in sections)
+    total_new = sum(s['duration'] for s in sections)
+    print("\n" + "=" * 60)
+    print("Done!")
+    print(f"Total duration: {total_original:.1f}s -> {total_new:.1f}s")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
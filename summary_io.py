@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Crash-safe reading and writing of sections_summary.json.
+
+Completed section updates are appended to a journal next to the summary
+(one JSON record per line, fsynced), and the summary itself is only ever
+replaced atomically (temp file + rename). An interrupted run leaves the old
+summary plus a journal of everything finished since, which the next run
+folds back in before continuing.
+
+Every process writes its own journal and holds an flock on it while it
+runs, so concurrent runs never fold or delete a journal that is still
+being written; only journals whose lock is free (their process is gone)
+are folded in by someone else. Journals are created and folded under a
+lock on the summary.
+"""
+
+import os
+import json
+import fcntl
+import threading
+from pathlib import Path
+
+def load_summary(summary_path):
+    """Section records from a summary file"""
+    with open(summary_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file in the same directory and rename it into place"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def summary_lock(summary_path, shared=False):
+    """
+    Blocking flock on a lock file next to the summary; the returned file
+    holds the lock until it is closed (use it in a with statement).
+    """
+    summary_path = Path(summary_path)
+    f = open(summary_path.with_name(f".{summary_path.name}.lock"), 'a')
+    fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    return f
+
+def journal_path(summary_path, pid):
+    """Journal file of one process writing to a summary"""
+    summary_path = Path(summary_path)
+    return summary_path.with_name(f"{summary_path.stem}.journal.{pid}.jsonl")
+
+def journal_paths(summary_path):
+    """All journals of a summary, oldest first"""
+    summary_path = Path(summary_path)
+    paths = summary_path.parent.glob(f"{summary_path.stem}.journal.*jsonl")
+    return sorted(paths, key=lambda p: p.stat().st_mtime_ns)
+
+class Journal:
+    """This process's journal, locked for as long as it is open"""
+
+    def __init__(self, summary_path):
+        self.path = journal_path(summary_path, os.getpid())
+        with summary_lock(summary_path):
+            # Created and locked in one step, so a compact() never sees it unlocked
+            self.file = open(self.path, 'a', encoding='utf-8')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """Durably append one section record"""
+        with self._lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def read_journal(journal):
+    """
+    Journaled records keyed by section number, later entries winning.
+    A torn last line from a crash mid-write is ignored.
+    """
+    records = {}
+    try:
+        with open(journal, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record['section']] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+def current_record(summary_path, section_num):
+    """
+    Latest record of one section: the summary with every journal folded in,
+    including those of runs still in progress.
+    """
+    with summary_lock(summary_path, shared=True):
+        updates = {}
+        for path in journal_paths(summary_path):
+            updates.update(read_journal(path))
+        if section_num in updates:
+            return updates[section_num]
+        for section in load_summary(summary_path):
+            if section['section'] == section_num:
+                return section
+    return None
+
+def compact(summary_path, journal=None):
+    """
+    Fold journal (this process's Journal, if any) and the journals of
+    finished or crashed runs into the summary on disk, write it atomically
+    and drop those journals. Journals of runs still in progress are left
+    for them. Returns (merged sections, section numbers folded in from
+    other runs' journals).
+    """
+    with summary_lock(summary_path):
+        sections = load_summary(summary_path)
+        updates, resumed, folded = {}, set(), []
+        for path in journal_paths(summary_path):
+            if journal is not None and path == journal.path:
+                updates.update(read_journal(path))
+                folded.append((path, None))
+                continue
+            f = open(path, 'rb')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            records = read_journal(path)
+            updates.update(records)
+            resumed.update(records)
+            folded.append((path, f))
+        
+        merged = [updates.get(section['section'], section) for section in sections]
+        if folded:
+            write_json_atomic(summary_path, merged)
+        for path, f in folded:
+            path.unlink()
+            if f is not None:
+                f.close()
+    return merged, resumed
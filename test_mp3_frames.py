@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for mp3_frames.py on synthetic frame streams (no ffmpeg needed).
+Run with: python -m unittest test_mp3_frames
+"""
+
+import os
+import tempfile
+import unittest
+
+import mp3_frames
+from mp3_frames import DECODER_DELAY, LAME_DELAY
+
+SPF = 1152  # MPEG-1 Layer III samples per frame
+
+def frame(bitrate_idx=9, rate_idx=1, main_data_begin=0):
+    """One MPEG-1 Layer III stereo frame without CRC (128 kbps, 48 kHz: 384 bytes)"""
+    header = mp3_frames.parse_header(bytes((0xFF, 0xFB, (bitrate_idx << 4) | (rate_idx << 2), 0)), 0)
+    data = bytearray(header['size'])
+    data[:4] = (0xFF, 0xFB, (bitrate_idx << 4) | (rate_idx << 2), 0)
+    data[4:6] = (main_data_begin << 7).to_bytes(2, 'big')  # First 9 bits of the side info
+    return bytes(data)
+
+def tagged(n_frames, n_samples, **kwargs):
+    """A stream of n_frames frames with an Info frame describing n_samples"""
+    return mp3_frames.add_info_frame(frame(**kwargs) * n_frames, n_samples)
+
+class HeaderTest(unittest.TestCase):
+
+    def test_mpeg1_sizes(self):
+        header = mp3_frames.parse_header(frame(), 0)
+        self.assertEqual((header['size'], header['sample_rate'], header['samples']), (384, 48000, 1152))
+        self.assertEqual(header['side_info'], 32)
+        self.assertEqual(len(frame(bitrate_idx=1)), 96)  # 32 kbps
+
+    def test_mpeg2_size(self):
+        # MPEG-2, 64 kbps, 24 kHz, mono: 72 * 64000 / 24000 bytes
+        header = mp3_frames.parse_header(bytes((0xFF, 0xF3, (8 << 4) | (1 << 2), 0xC0)), 0)
+        self.assertEqual((header['size'], header['samples'], header['side_info']), (192, 576, 9))
+
+    def test_invalid(self):
+        self.assertIsNone(mp3_frames.parse_header(b'\xff\xfb\xf4\x00', 0))  # Bitrate index 15
+        self.assertIsNone(mp3_frames.parse_header(b'\xff\xfb\x9c\x00', 0))  # Sample rate index 3
+        self.assertIsNone(mp3_frames.parse_header(b'\xff\xfd\x94\x00', 0))  # Layer II
+        self.assertIsNone(mp3_frames.parse_header(b'\xff\xfb', 0))
+
+class InfoFrameTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        n_samples = 20 * SPF - LAME_DELAY - 1000
+        data = tagged(20, n_samples)
+        stream = mp3_frames.Mp3Stream(data)
+        self.assertEqual(len(stream.frames), 20)
+        self.assertEqual((stream.enc_delay, stream.enc_padding), (LAME_DELAY, 1000))
+
+        fd, path = tempfile.mkstemp(suffix=".mp3")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            self.assertEqual(mp3_frames.gapless_samples(path), (n_samples, 48000))
+        finally:
+            os.unlink(path)
+
+    def test_fields_and_crc(self):
+        data = tagged(10, 10 * SPF - LAME_DELAY - 500)
+        stream = mp3_frames.Mp3Stream(data)
+        info = data[stream.info_offset:stream.info_offset + stream.info_header['size']]
+        base = stream.info_offset
+        self.assertEqual(int.from_bytes(data[stream.xing_frames_pos:stream.xing_frames_pos + 4], 'big'), 10)
+        self.assertEqual(int.from_bytes(data[stream.xing_bytes_pos:stream.xing_bytes_pos + 4], 'big'),
+                         len(data))
+        lame = stream.lame - base
+        self.assertEqual(int.from_bytes(info[lame + 34:lame + 36], 'big'), mp3_frames.crc16(info[:lame + 34]))
+        toc = data[stream.xing_toc_pos:stream.xing_toc_pos + 100]
+        self.assertEqual(list(toc), sorted(toc))
+
+    def test_padding_clamped(self):
+        # More samples than the frames hold still get a header, with no padding
+        stream = mp3_frames.Mp3Stream(tagged(5, 10 * SPF))
+        self.assertIsNotNone(stream.lame)
+        self.assertEqual(stream.enc_padding, 0)
+
+    def test_already_tagged(self):
+        data = tagged(5, 4 * SPF)
+        self.assertEqual(mp3_frames.add_info_frame(data, 3 * SPF), data)
+
+class PlanCutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.n_samples = 50 * SPF - LAME_DELAY - 700
+        self.stream = mp3_frames.Mp3Stream(tagged(50, self.n_samples))
+
+    def test_start_zero(self):
+        first, last, enc_delay, enc_padding = mp3_frames.plan_cut(self.stream, 0, 1.0)
+        self.assertEqual((first, enc_delay), (0, LAME_DELAY))
+        # Frames cover the cut, padding removes the rest of the last one
+        self.assertEqual((last - first) * SPF - enc_delay - enc_padding, 48000)
+
+    def test_cut_past_end(self):
+        first, last, enc_delay, enc_padding = mp3_frames.plan_cut(self.stream, 0.5, 100.0)
+        self.assertEqual(last, 50)
+        self.assertEqual(enc_padding, 700)
+        self.assertEqual((last - first) * SPF - enc_delay - enc_padding, self.n_samples - 24000)
+
+    def test_mid_cut_keeps_previous_frame(self):
+        first, last, enc_delay, enc_padding = mp3_frames.plan_cut(self.stream, 0.5, 0.3)
+        cut_start = LAME_DELAY + DECODER_DELAY + 24000
+        self.assertEqual(first, cut_start // SPF - 1)
+        self.assertEqual(enc_delay, cut_start - first * SPF - DECODER_DELAY)
+        self.assertEqual((last - first) * SPF - enc_delay - enc_padding, 14400)
+
+    def test_empty_cut(self):
+        self.assertIsNone(mp3_frames.plan_cut(self.stream, 100.0, 1.0))
+
+    def test_no_lame_tag(self):
+        self.assertIsNone(mp3_frames.plan_cut(mp3_frames.Mp3Stream(frame() * 10), 0, 0.1))
+
+    def test_delay_overflow(self):
+        # 32 kbps frames carry 60 bytes of main data, so a 511 byte reservoir
+        # reaches 9 frames back and the delay no longer fits in 12 bits
+        stream = mp3_frames.Mp3Stream(tagged(50, 40 * SPF, bitrate_idx=1, main_data_begin=511))
+        self.assertEqual(mp3_frames.reservoir_start(stream, 20), 11)
+        self.assertIsNone(mp3_frames.plan_cut(stream, 0.5, 0.3))
+
+    def test_junk_after_frames(self):
+        data = tagged(10, 9 * SPF) + b'junk' + frame() * 50
+        self.assertIsNone(mp3_frames.plan_cut(mp3_frames.Mp3Stream(data), 0, 0.3))
+
+    def test_id3v1_trailer_kept(self):
+        trailer = b'TAG' + bytes(125)
+        stream = mp3_frames.Mp3Stream(tagged(10, 9 * SPF) + trailer)
+        plan = mp3_frames.plan_cut(stream, 0, 0.05)
+        self.assertIsNotNone(plan)
+        out = stream.build(*plan)
+        self.assertTrue(out.endswith(trailer))
+        self.assertEqual(len(mp3_frames.Mp3Stream(out).frames), plan[1] - plan[0])
+
+if __name__ == "__main__":
+    unittest.main()
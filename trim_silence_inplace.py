@@ -3,23 +3,41 @@
 Trim silence from MP3 files in-place with aggressive trailing silence detection.
 """
 
-import subprocess
+import os
 import re
+import stat
+import fcntl
+import tempfile
 from pathlib import Path
-import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def detect_silence_full(mp3_path, noise_db=-40, min_duration=0.2):
+import ffmpeg_jobs
+import media_probe
+import mp3_frames
+from disk_cache import full_file_hash
+import pcm_buffer
+import silence_analysis
+import summary_io
+
+def detect_silence_full(mp3_path, noise_db=-40, min_duration=0.2, backend='numpy', samples=None):
     """
     Detect all silence periods in MP3.
+    backend: 'numpy' analyzes the PCM in-process, 'ffmpeg' runs silencedetect
+    samples: the section's slice of the shared PCM map, read instead of mp3_path
     Returns list of (start, end) tuples for silence periods.
     """
+    if backend == 'numpy':
+        return silence_analysis.detect_silences(mp3_path, noise_db, min_duration,
+                                                samples=samples, sample_rate=pcm_buffer.PCM_RATE)
+    
     cmd = [
         'ffmpeg', '-i', mp3_path,
         '-af', f'silencedetect=noise={noise_db}dB:d={min_duration}',
         '-f', 'null', '-'
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = ffmpeg_jobs.run(cmd, text=True)
     output = result.stderr
     
     silences = []
@@ -45,25 +63,15 @@ def detect_silence_full(mp3_path, noise_db=-40, min_duration=0.2):
 
 def get_audio_duration(mp3_path):
     """Get audio duration in seconds"""
-    cmd = [
-        'ffprobe', '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        mp3_path
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return float(result.stdout.strip())
+    return media_probe.get_duration(mp3_path)
 
-def trim_silence_inplace(mp3_path):
+def compute_trim(silences, duration):
     """
-    Trim leading and trailing silence from MP3 file in-place.
-    Returns (trim_start, trim_end, original_duration, new_duration)
+    Trim amounts from detected silence periods.
+    Returns (trim_start, trim_end) in seconds, (0, 0) if the file should be kept.
     """
-    duration = get_audio_duration(mp3_path)
-    silences = detect_silence_full(str(mp3_path))
-    
     if not silences:
-        return 0, 0, duration, duration
+        return 0, 0
     
     # Determine trim amounts
     trim_start = 0
@@ -96,12 +104,129 @@ def trim_silence_inplace(mp3_path):
     
     if new_duration < 0.5:
         # Too much would be trimmed, keep original
-        return 0, 0, duration, duration
+        return 0, 0
     
+    return trim_start, trim_end
+
+def plan_trim(silences, duration):
+    """
+    Trim this script applies to a file: compute_trim(), or (0, 0) unless
+    one of the cuts is over 0.1s. Returns (trim_start, trim_end).
+    """
+    trim_start, trim_end = compute_trim(silences, duration)
     if trim_start > 0.1 or trim_end > 0.1:
-        # Need to trim - use ffmpeg to create temp file then replace
+        return trim_start, trim_end
+    return 0, 0
+
+def get_playback_duration(mp3_path):
+    """Duration after encoder delay/padding (what a gapless decoder plays)"""
+    return mp3_frames.gapless_duration(mp3_path) or get_audio_duration(mp3_path)
+
+def commit_file(path, data):
+    """
+    Replace path with data atomically: one write to a uniquely named temp
+    file in the same directory, fsync, rename. Concurrent writers never
+    share a temp name, and readers see the old or the new file, never half.
+    The file keeps its permissions (mkstemp creates the temp file 0600).
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if path.exists():
+                os.fchmod(f.fileno(), stat.S_IMODE(os.stat(path).st_mode))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def trimmed_bytes(mp3_path, trim_start, new_duration, lossless=False, scratch_dir=None):
+    """
+    The trimmed MP3 in memory, or None if ffmpeg failed.
+    The re-encode goes to ffmpeg's stdout, or to a temp file in scratch_dir
+    (e.g. a tmpfs) when given; a piped MP3 gets its Xing/LAME header added
+    afterwards since ffmpeg only writes it to seekable outputs.
+    """
+    if lossless:
+        data = mp3_frames.cut_bytes(mp3_path, trim_start, new_duration)
+        if data is not None:
+            return data
+    
+    cmd = [
+        'ffmpeg', '-y', '-i', str(mp3_path),
+        '-ss', str(trim_start),
+        '-t', str(new_duration),
+        '-codec:a', 'libmp3lame',
+        '-q:a', '2'
+    ]
+    if scratch_dir is None:
+        result = ffmpeg_jobs.run(cmd + ['-f', 'mp3', '-'])
+        if result.returncode != 0 or not result.stdout:
+            return None
+        # What ffmpeg decoded from trim_start on, capped by the requested
+        # length: the cut may run past the end of the input's audio
+        gapless = mp3_frames.gapless_samples(mp3_path)
+        if gapless is not None:
+            input_samples, sample_rate = gapless
+        else:
+            sample_rate = media_probe.probe(mp3_path).sample_rate
+            input_samples = int(round(get_audio_duration(mp3_path) * sample_rate))
+        n_samples = min(int(round(new_duration * sample_rate)),
+                        input_samples - int(round(trim_start * sample_rate)))
+        return mp3_frames.add_info_frame(result.stdout, n_samples)
+    
+    fd, scratch_path = tempfile.mkstemp(dir=scratch_dir, suffix=".mp3")
+    os.close(fd)
+    try:
+        result = ffmpeg_jobs.run(cmd + [scratch_path])
+        if result.returncode != 0:
+            return None
+        with open(scratch_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.unlink(scratch_path)
+
+def trim_silence_inplace(mp3_path, duration=None, silences=None, lossless=False,
+                         pipe=False, scratch_dir=None):
+    """
+    Trim leading and trailing silence from MP3 file in-place.
+    duration/silences: results already computed for mp3_path, if any
+    lossless: cut whole frames and fix up the gapless header instead of
+    re-encoding; falls back to re-encoding when that can't be exact
+    pipe/scratch_dir: build the result in memory (or on a scratch
+    directory) and commit it with a single write instead of encoding to a
+    temp file next to the original
+    Returns (trim_start, trim_end, original_duration, new_duration), or
+    None if trimming failed and the file was left as it was
+    """
+    if duration is None:
+        duration = get_playback_duration(mp3_path) if lossless else get_audio_duration(mp3_path)
+    if silences is None:
+        silences = detect_silence_full(str(mp3_path))
+    
+    trim_start, trim_end = plan_trim(silences, duration)
+    new_duration = duration - trim_start - trim_end
+    
+    if (trim_start or trim_end) and (pipe or scratch_dir is not None):
+        data = trimmed_bytes(mp3_path, trim_start, new_duration, lossless, scratch_dir)
+        if data is None:
+            print(f"    Error trimming {mp3_path}")
+            return None
+        commit_file(mp3_path, data)
+        return trim_start, trim_end, duration, new_duration
+    
+    if trim_start or trim_end:
         temp_path = str(mp3_path) + ".tmp.mp3"
         
+        if lossless and mp3_frames.trim_lossless(mp3_path, temp_path, trim_start, new_duration):
+            os.replace(temp_path, mp3_path)
+            return trim_start, trim_end, duration, new_duration
+        
+        # Need to trim - use ffmpeg to create temp file then replace
         cmd = [
             'ffmpeg', '-y', '-i', str(mp3_path),
             '-ss', str(trim_start),
@@ -111,75 +236,246 @@ def trim_silence_inplace(mp3_path):
             temp_path
         ]
         
-        result = subprocess.run(cmd, capture_output=True)
+        result = ffmpeg_jobs.run(cmd)
         
         if result.returncode == 0:
             # Replace original with trimmed version
-            import os
             os.replace(temp_path, mp3_path)
             return trim_start, trim_end, duration, new_duration
         else:
             print(f"    Error trimming {mp3_path}: {result.stderr}")
             if Path(temp_path).exists():
                 Path(temp_path).unlink()
-            return 0, 0, duration, duration
+            return None
     
     return 0, 0, duration, duration
 
+def ledger_entry(mp3_path, params):
+    """Ledger record for a finished file: content hash, stat and parameters"""
+    st = os.stat(mp3_path)
+    return {
+        'hash': full_file_hash(mp3_path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'params': params
+    }
+
+def ledger_matches(section, mp3_path, params):
+    """
+    True if the file is still the one this script produced with the same
+    parameters. An unchanged size/mtime is trusted without reading the file;
+    otherwise the content hash decides (and the stat is refreshed).
+    """
+    ledger = section.get('trim_ledger')
+    if not ledger or ledger.get('params') != params:
+        return False
+    try:
+        st = os.stat(mp3_path)
+    except OSError:
+        return False
+    if st.st_size == ledger['size'] and st.st_mtime_ns == ledger['mtime_ns']:
+        return True
+    if full_file_hash(mp3_path) != ledger['hash']:
+        return False
+    ledger['size'], ledger['mtime_ns'] = st.st_size, st.st_mtime_ns
+    return True
+
+def lock_file(path):
+    """
+    Exclusive advisory lock for a file, or None if another process holds it.
+    The lock is taken on a sidecar (.name.lock) rather than the file itself:
+    trimming renames a new inode onto the path, and a lock on the old inode
+    would not stop the next trimmer from locking the new one. The sidecar is
+    never removed, for the same reason.
+    Keep the returned file object open for as long as the lock is needed.
+    """
+    path = Path(path)
+    f = open(path.with_name(f".{path.name}.lock"), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+def trim_section(section, mp3_dir, args, params, journal=None):
+    """
+    Trim one section's MP3 in place and update its record.
+    journal: summary_io.Journal the updated record is appended to while
+    the file is still locked; skipped and failed sections are not journaled
+    Returns (section, log, done) where log holds the lines to print, so
+    concurrent sections don't interleave their output, and done is True
+    if the file is trimmed and section describes it (it was trimmed now or
+    already by another trimmer).
+    """
+    section_num = section['section']
+    mp3_path = mp3_dir / section['audio']
+    
+    log = [f"\nSection {section_num}: {section['audio']}"]
+    
+    # Another trimmer working on the same directory has this file
+    lock = None
+    if args.lock:
+        lock = lock_file(mp3_path)
+        if lock is None:
+            log.append("  - Locked by another trimmer, skipped")
+            return section, log, False
+    try:
+        if lock is not None:
+            # It may have finished this file since our summary was read
+            section = summary_io.current_record(mp3_dir / "sections_summary.json",
+                                                section_num) or section
+            if ledger_matches(section, mp3_path, params):
+                log.append("  - Already trimmed by another trimmer, skipped")
+                return section, log, True
+        section, done = _trim_section(section, mp3_path, mp3_dir, args, params, log)
+        if done and journal is not None:
+            journal.append(section)
+        return section, log, done
+    finally:
+        if lock is not None:
+            lock.close()
+
+def _trim_section(section, mp3_path, mp3_dir, args, params, log):
+    """trim_section() once the file is ours; returns (section, done)"""
+    log.append(f"  Current duration: {section['duration']:.2f}s")
+    
+    # Detect silences for reporting, from the shared PCM map if there is one
+    samples = None
+    if args.silence_backend == 'numpy':
+        samples = pcm_buffer.section_samples(section, mp3_dir)
+    if args.noise_db != 'auto':
+        silences = detect_silence_full(str(mp3_path), float(args.noise_db),
+                                       backend=args.silence_backend, samples=samples)
+    elif 'silence_threshold_db' in section:
+        # Reuse the threshold estimated by an earlier run
+        silences = detect_silence_full(str(mp3_path), section['silence_threshold_db'],
+                                       backend=args.silence_backend, samples=samples)
+    else:
+        silences, noise_floor_db, noise_db = silence_analysis.detect_silences_auto(
+            str(mp3_path), min_duration=0.2, samples=samples, sample_rate=pcm_buffer.PCM_RATE)
+        section['noise_floor_db'] = noise_floor_db
+        section['silence_threshold_db'] = noise_db
+        log.append(f"  Noise floor: {noise_floor_db:.1f} dB -> threshold {noise_db:.1f} dB")
+    if args.lossless:
+        duration = get_playback_duration(str(mp3_path))
+    else:
+        duration = get_audio_duration(str(mp3_path))
+    
+    if silences:
+        log.append(f"  Silence periods detected: {len(silences)}")
+        for i, (s, e) in enumerate(silences):
+            if e is None:
+                log.append(f"    [{i+1}] {s:.2f}s -> END (trailing silence: {duration - s:.2f}s)")
+            else:
+                log.append(f"    [{i+1}] {s:.2f}s -> {e:.2f}s (duration: {e - s:.2f}s)")
+    
+    # Trim in-place
+    result = trim_silence_inplace(mp3_path, duration, silences, lossless=args.lossless,
+                                  pipe=args.pipe, scratch_dir=args.scratch_dir)
+    if result is None:
+        # No ledger entry, so the next run tries this file again
+        log.append(f"  ✗ Trimming failed, file left unchanged")
+        return section, False
+    trim_start, trim_end, orig_dur, new_dur = result
+    
+    if trim_start > 0 or trim_end > 0:
+        log.append(f"  ✓ Trimmed: start={trim_start:.2f}s, end={trim_end:.2f}s")
+        log.append(f"  ✓ New duration: {new_dur:.2f}s")
+        
+        # Update cumulative trim info
+        section['trim_start'] = section.get('trim_start', 0) + trim_start
+        section['trim_end'] = section.get('trim_end', 0) + trim_end
+        section['duration'] = new_dur
+    else:
+        log.append(f"  - No significant silence to trim")
+    
+    section['trim_ledger'] = ledger_entry(mp3_path, params)
+    return section, True
+
 def main():
-    mp3_dir = Path("output_sections_mp3")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mp3-dir', default="output_sections_mp3")
+    parser.add_argument('--silence-backend', choices=['numpy', 'ffmpeg'], default='numpy',
+                        help="numpy: in-process PCM analysis (default); ffmpeg: silencedetect")
+    parser.add_argument('--lossless', action='store_true',
+                        help="cut on MP3 frame boundaries with gapless delay/padding "
+                             "instead of re-encoding")
+    parser.add_argument('--noise-db', default='-40',
+                        help="silence threshold in dB, or 'auto' to place it relative to "
+                             "each file's estimated noise floor")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="files to trim concurrently")
+    parser.add_argument('--pipe', action='store_true',
+                        help="stream the trimmed MP3 through ffmpeg's stdout into memory and "
+                             "replace the original with one atomic write")
+    parser.add_argument('--scratch-dir',
+                        help="like --pipe, but let ffmpeg encode to a temp file here "
+                             "(e.g. /dev/shm) before the atomic write")
+    parser.add_argument('--lock', action='store_true',
+                        help="flock each file while trimming it and skip files another "
+                             "trimmer holds or has finished, so several can run over one "
+                             "directory")
+    args = parser.parse_args()
+    
+    mp3_dir = Path(args.mp3_dir)
+    summary_path = mp3_dir / "sections_summary.json"
     
-    # Load sections data
-    with open(mp3_dir / "sections_summary.json", 'r', encoding='utf-8') as f:
-        sections = json.load(f)
+    # Load sections data, folding in what an interrupted run finished
+    sections, resumed = summary_io.compact(summary_path)
+    journal = summary_io.Journal(summary_path)
     
     print("=" * 70)
     print("Trimming silence from MP3 files in-place")
     print("=" * 70)
+    if resumed:
+        print(f"Resuming: {len(resumed)} sections already done by an interrupted run")
     
-    updated_sections = []
+    skipped = 0
+    params = {
+        'noise_db': args.noise_db,
+        'min_duration': 0.2,
+        'silence_backend': args.silence_backend,
+        'lossless': args.lossless
+    }
     
-    for section in sections:
-        section_num = section['section']
-        mp3_path = mp3_dir / section['audio']
-        
-        print(f"\nSection {section_num}: {section['audio']}")
-        print(f"  Current duration: {section['duration']:.2f}s")
-        
-        # Detect silences for reporting
-        silences = detect_silence_full(str(mp3_path))
-        duration = get_audio_duration(str(mp3_path))
-        
-        if silences:
-            print(f"  Silence periods detected: {len(silences)}")
-            for i, (s, e) in enumerate(silences):
-                if e is None:
-                    print(f"    [{i+1}] {s:.2f}s -> END (trailing silence: {duration - s:.2f}s)")
-                else:
-                    print(f"    [{i+1}] {s:.2f}s -> {e:.2f}s (duration: {e - s:.2f}s)")
-        
-        # Trim in-place
-        trim_start, trim_end, orig_dur, new_dur = trim_silence_inplace(mp3_path)
-        
-        if trim_start > 0 or trim_end > 0:
-            print(f"  ✓ Trimmed: start={trim_start:.2f}s, end={trim_end:.2f}s")
-            print(f"  ✓ New duration: {new_dur:.2f}s")
-            
-            # Update cumulative trim info
-            section['trim_start'] = section.get('trim_start', 0) + trim_start
-            section['trim_end'] = section.get('trim_end', 0) + trim_end
-            section['duration'] = new_dur
+    pending = []
+    for i, section in enumerate(sections):
+        # Already trimmed with these parameters and untouched since; this
+        # covers journaled sections too, their records carry the ledger
+        if ledger_matches(section, mp3_dir / section['audio'], params):
+            skipped += 1
         else:
-            print(f"  - No significant silence to trim")
-        
-        updated_sections.append(section)
+            pending.append(i)
     
-    # Save updated summary
-    with open(mp3_dir / "sections_summary.json", 'w', encoding='utf-8') as f:
-        json.dump(updated_sections, f, indent=2, ensure_ascii=False)
+    # Every finished section goes to the journal right away, so a crash
+    # loses at most the files that were being trimmed at the time
+    try:
+        if args.jobs > 1:
+            # Longest sections first, so the last ones to finish are short
+            pending.sort(key=lambda i: -sections[i]['duration'])
+            with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+                futures = [
+                    pool.submit(trim_section, sections[i], mp3_dir, args, params, journal)
+                    for i in pending
+                ]
+                for future in as_completed(futures):
+                    _, log, _ = future.result()
+                    print('\n'.join(log))
+        else:
+            for i in pending:
+                _, log, _ = trim_section(sections[i], mp3_dir, args, params, journal)
+                print('\n'.join(log))
+        
+        # Save updated summary, with what other trimmers finished meanwhile
+        updated_sections, _ = summary_io.compact(summary_path, journal)
+    finally:
+        journal.close()
     
     print("\n" + "=" * 70)
     print("Done! All MP3 files trimmed in-place.")
+    if skipped:
+        print(f"Skipped {skipped} already trimmed files (ledger unchanged)")
     print("=" * 70)
     
     # Show total savings